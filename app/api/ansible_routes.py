@@ -1,5 +1,4 @@
 from flask import jsonify, request
-import os
 import logging
 
 from app.models.application_instance import ApplicationInstance
@@ -272,10 +271,7 @@ def test_playbook_execution(app_id):
                     dynamic_params[param.name] = extra_vars[param.name]
 
         # Формируем команду
-        playbook_full_path = os.path.join(
-            ssh_service.ssh_config.ansible_path,
-            playbook_config.path.lstrip('/')
-        )
+        playbook_full_path = ssh_service.build_playbook_full_path(playbook_config.path)
 
         ansible_cmd = ssh_service.build_ansible_command(
             playbook_full_path,
@@ -153,6 +153,11 @@ def generate_ssh_key():
 
             logger.info(f"Новый SSH-ключ сгенерирован: {key_file}")
 
+            # Открытое мастер-соединение ControlMaster аутентифицировано старым ключом:
+            # останавливаем его (ssh -O stop), чтобы новые вызовы ssh проверяли уже новый
+            # ключ, а идущие через него сеансы (в том числе деплои) доработали
+            run_async(get_ssh_ansible_service().close_connection())
+
             return jsonify({
                 'success': True,
                 'message': 'SSH-ключ успешно сгенерирован',
@@ -188,9 +193,12 @@ def check_playbooks():
         # Получаем сервис
         ssh_service = get_ssh_ansible_service()
 
+        # refresh=true - перечитать каталог в обход кэша листинга
+        force_refresh = request.args.get('refresh', 'false').lower() == 'true'
+
         # Получаем список всех playbook файлов из каталога
         async def get_all_playbook_files():
-            return await ssh_service.get_all_playbooks()
+            return await ssh_service.get_all_playbooks(force_refresh=force_refresh)
 
         # Запускаем получение списка
         results = run_async(get_all_playbook_files())
@@ -269,21 +277,17 @@ def get_ssh_status():
             try:
                 ssh_service = get_ssh_ansible_service()
 
-                # Тест подключения
-                connection_result = run_async(ssh_service.test_connection())
+                # Тест подключения и список playbook-ов - одним SSH-вызовом
+                connected, message, playbook_results_dict = run_async(
+                    ssh_service.check_connection_and_playbooks()
+                )
                 status['connection_status'] = {
-                    'connected': connection_result[0],
-                    'message': connection_result[1]
+                    'connected': connected,
+                    'message': message
                 }
 
                 # Если подключение успешно, проверяем playbook-и
-                if connection_result[0]:
-                    # Используем новый метод для получения всех playbooks
-                    async def get_all_playbook_files():
-                        return await ssh_service.get_all_playbooks()
-
-                    playbook_results_dict = run_async(get_all_playbook_files())
-
+                if connected:
                     # Преобразуем для совместимости с текущим форматом
                     playbook_results = {}
                     for playbook_name, info in playbook_results_dict.items():
@@ -13,6 +13,49 @@ from app.services.ssh_ansible_service import SSHAnsibleService
 
 logger = logging.getLogger(__name__)
 
+# Блок PLAY RECAP и последующие строки с результатами
+_RECAP_PATTERN = re.compile(
+    r'PLAY RECAP \*+\s*\n((?:[^\n]+\n)*?)(?=\n(?:PLAY |$)|\Z)',
+    re.MULTILINE
+)
+
+# Строка с результатами хоста в блоке PLAY RECAP
+_RECAP_HOST_PATTERN = re.compile(
+    r'^(\S+)\s*:\s*'
+    r'ok=(\d+)\s+'
+    r'changed=(\d+)\s+'
+    r'unreachable=(\d+)\s+'
+    r'failed=(\d+)'
+    r'(?:\s+skipped=(\d+))?'
+    r'(?:\s+rescued=(\d+))?'
+    r'(?:\s+ignored=(\d+))?',
+    re.MULTILINE
+)
+
+# TASK [Display summary] в прямом формате (реальные переносы строк):
+# TASK [Display summary] ***
+# ok: [localhost] => {
+#     "msg": "..."
+# }
+_SUMMARY_TASK_PATTERN = re.compile(
+    r'TASK \[([^\]]*[Ss]ummary[^\]]*)\] \*+\s*\n'
+    r'(?:ok|changed): \[([^\]]+)\] => \{\s*\n'
+    r'\s*"msg":\s*(.+?)\n\}',
+    re.DOTALL
+)
+
+# TASK [Display summary] в escaped формате (\\n вместо реальных переносов),
+# обычно появляется когда include_tasks логирует вывод
+_SUMMARY_TASK_ESCAPED_PATTERN = re.compile(
+    r'TASK \[([^\]]*[Ss]ummary[^\]]*)\] \*+\\n'
+    r'(?:ok|changed): \[([^\]]+)\] => \{\\n'
+    r'\s*\\"msg\\":\s*(.+?)(?:\\n\}|"\s*\])',
+    re.DOTALL
+)
+
+# Строки в кавычках внутри массива msg
+_QUOTED_STRING_PATTERN = re.compile(r'"([^"]*)"')
+
 
 def parse_ansible_summary(output: str) -> list:
     """
@@ -29,37 +72,18 @@ def parse_ansible_summary(output: str) -> list:
     Returns:
         Список словарей с summary для каждого PLAY RECAP
     """
-    if not output:
+    # Быстрая проверка подстрокой до запуска многострочного regex
+    if not output or 'PLAY RECAP' not in output:
         return []
 
     summaries = []
 
-    # Находим все блоки PLAY RECAP
-    # Паттерн для поиска PLAY RECAP и последующих строк с результатами
-    recap_pattern = re.compile(
-        r'PLAY RECAP \*+\s*\n((?:[^\n]+\n)*?)(?=\n(?:PLAY |$)|\Z)',
-        re.MULTILINE
-    )
-
-    # Паттерн для парсинга строки с результатами хоста
-    host_pattern = re.compile(
-        r'^(\S+)\s*:\s*'
-        r'ok=(\d+)\s+'
-        r'changed=(\d+)\s+'
-        r'unreachable=(\d+)\s+'
-        r'failed=(\d+)'
-        r'(?:\s+skipped=(\d+))?'
-        r'(?:\s+rescued=(\d+))?'
-        r'(?:\s+ignored=(\d+))?',
-        re.MULTILINE
-    )
-
     # Ищем все PLAY RECAP блоки
-    for match in recap_pattern.finditer(output):
+    for match in _RECAP_PATTERN.finditer(output):
         recap_block = match.group(1)
 
         # Парсим каждую строку хоста в блоке
-        for host_match in host_pattern.finditer(recap_block):
+        for host_match in _RECAP_HOST_PATTERN.finditer(recap_block):
             summary = {
                 'host': host_match.group(1),
                 'ok': int(host_match.group(2)),
@@ -90,25 +114,15 @@ def parse_display_summary_tasks(output: str) -> list:
     Returns:
         Список словарей с содержимым summary tasks
     """
-    if not output:
+    # Большинство плейбуков не выводят summary: отсекаем их без DOTALL-регулярок
+    if not output or 'ummary' not in output:
         return []
 
     summaries = []
     seen_content = set()  # Для дедупликации
 
     # Паттерн 1: Прямой формат (реальные переносы строк)
-    # TASK [Display summary] ***
-    # ok: [localhost] => {
-    #     "msg": "..."
-    # }
-    pattern1 = re.compile(
-        r'TASK \[([^\]]*[Ss]ummary[^\]]*)\] \*+\s*\n'
-        r'(?:ok|changed): \[([^\]]+)\] => \{\s*\n'
-        r'\s*"msg":\s*(.+?)\n\}',
-        re.DOTALL
-    )
-
-    for match in pattern1.finditer(output):
+    for match in _SUMMARY_TASK_PATTERN.finditer(output):
         task_name = match.group(1)
         host = match.group(2)
         msg_content = match.group(3).strip()
@@ -126,15 +140,7 @@ def parse_display_summary_tasks(output: str) -> list:
                 })
 
     # Паттерн 2: Escaped формат (\\n вместо реальных переносов)
-    # Обычно появляется когда include_tasks логирует вывод
-    pattern2 = re.compile(
-        r'TASK \[([^\]]*[Ss]ummary[^\]]*)\] \*+\\n'
-        r'(?:ok|changed): \[([^\]]+)\] => \{\\n'
-        r'\s*\\"msg\\":\s*(.+?)(?:\\n\}|"\s*\])',
-        re.DOTALL
-    )
-
-    for match in pattern2.finditer(output):
+    for match in _SUMMARY_TASK_ESCAPED_PATTERN.finditer(output):
         task_name = match.group(1)
         host = match.group(2)
         msg_content = match.group(3).strip()
@@ -170,7 +176,7 @@ def _parse_msg_content(msg_content: str) -> str:
 
         if msg_content.startswith('['):
             # Массив строк - извлекаем строки
-            lines = re.findall(r'"([^"]*)"', msg_content)
+            lines = _QUOTED_STRING_PATTERN.findall(msg_content)
             return '\n'.join(lines)
         elif msg_content.startswith('"'):
             # Одна строка (может содержать \n)
@@ -74,7 +74,21 @@ class Config:
     SSH_KNOWN_HOSTS_FILE = os.environ.get('SSH_KNOWN_HOSTS_FILE') or '/app/.ssh/known_hosts'
     SSH_CONNECTION_TIMEOUT = int(os.environ.get('SSH_CONNECTION_TIMEOUT') or 30)
     SSH_COMMAND_TIMEOUT = int(os.environ.get('SSH_COMMAND_TIMEOUT') or 300)
+    # Мультиплексирование SSH (ControlMaster): повторные вызовы ssh используют уже открытое соединение
+    SSH_CONTROL_PATH = os.environ.get('SSH_CONTROL_PATH') or '/app/.ssh/cm-%r@%h:%p'
+    SSH_CONTROL_PERSIST = os.environ.get('SSH_CONTROL_PERSIST') or '600s'
     ANSIBLE_PATH = os.environ.get('ANSIBLE_PATH') or '/etc/ansible'
+    # Ansible pipelining: одна SSH-сессия на задачу вместо нескольких (требует отключенного requiretty в sudoers).
+    # Выставляется переменной окружения и имеет приоритет над pipelining в ansible.cfg
+    ANSIBLE_PIPELINING = os.environ.get('ANSIBLE_PIPELINING', 'true').lower() == 'true'
+    # Аргументы ssh для ansible на управляемые хосты (пусто - берутся из ansible.cfg).
+    # Непустое значение заменяет ssh_args из ansible.cfg целиком (ProxyJump, known_hosts и т.п.),
+    # например: '-o ControlMaster=auto -o ControlPersist=60s'
+    ANSIBLE_SSH_ARGS = os.environ.get('ANSIBLE_SSH_ARGS', '')
+    # Сколько последних строк stderr Ansible хранится для сообщения об ошибке
+    ANSIBLE_OUTPUT_TAIL_LINES = int(os.environ.get('ANSIBLE_OUTPUT_TAIL_LINES') or 500)
+    # Время жизни кэша листинга playbook-ов ansible каталога, секунды
+    PLAYBOOKS_CACHE_TTL = int(os.environ.get('PLAYBOOKS_CACHE_TTL') or 60)
 
     MAX_ARTIFACTS_DISPLAY = int(os.environ.get('MAX_ARTIFACTS_DISPLAY') or 120)
     INCLUDE_SNAPSHOT_VERSIONS = os.environ.get('INCLUDE_SNAPSHOT_VERSIONS', 'true').lower() == 'true'
@@ -124,6 +138,7 @@ class Config:
     REPORT_EMAIL_SUBJECT_PREFIX = os.environ.get('REPORT_EMAIL_SUBJECT_PREFIX', '[AC Report]')
     REPORT_DEFAULT_RECIPIENTS = os.environ.get('REPORT_DEFAULT_RECIPIENTS', '')  # email-адреса или группы через запятую
     SENDMAIL_PATH = os.environ.get('SENDMAIL_PATH', '/usr/sbin/sendmail')
+    REPORT_HTML_ROW_CAP = int(os.environ.get('REPORT_HTML_ROW_CAP', '500'))  # строк в HTML-теле письма, остальное только в CSV
 
     # Настройки системных тегов
     SYSTEM_TAGS_ENABLED = os.environ.get('SYSTEM_TAGS_ENABLED', 'true').lower() == 'true'
@@ -107,9 +107,10 @@ class MailingGroup(db.Model):
             recipients: Список получателей (email или имена групп)
 
         Returns:
-            Список уникальных email-адресов
+            Список уникальных email-адресов в порядке первого упоминания
         """
-        resolved_emails = set()
+        # dict вместо set: дедупликация с сохранением порядка
+        resolved_emails = {}
 
         for recipient in recipients:
             recipient = recipient.strip()
@@ -118,13 +119,13 @@ class MailingGroup(db.Model):
 
             # Проверяем, похоже ли на email (содержит @ и точку после @)
             if '@' in recipient and '.' in recipient.split('@')[-1]:
-                resolved_emails.add(recipient)
+                resolved_emails.setdefault(recipient)
             else:
                 # Ищем группу по имени
                 group = cls.find_by_name(recipient)
                 if group:
                     for email in group.get_emails_list():
-                        resolved_emails.add(email)
+                        resolved_emails.setdefault(email)
 
         return list(resolved_emails)
 
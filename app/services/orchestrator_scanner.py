@@ -5,6 +5,7 @@
 """
 
 import os
+import shlex
 import asyncio
 import logging
 from datetime import datetime
@@ -14,6 +15,7 @@ from app import db
 from app.models import OrchestratorPlaybook
 from app.config import Config
 from app.services.orchestrator_parser import parse_orchestrator_metadata, validate_metadata
+from app.services.ssh_ansible_service import SSHAnsibleService, SSHConfig, get_ssh_ansible_service
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +36,8 @@ class OrchestratorScanner:
                 - key_file: путь к SSH ключу (опционально)
                 - ansible_path: путь к каталогу с playbook-ами на удаленном хосте
                 - scan_pattern: паттерн для поиска orchestrator playbooks
+                - control_path: сокет ControlMaster (опционально)
+                - control_persist: время жизни мастер-соединения
         """
         self.ssh_config = ssh_config
         self.host = ssh_config.get('host', 'localhost')
@@ -43,11 +47,25 @@ class OrchestratorScanner:
         self.ansible_path = ssh_config.get('ansible_path', '/etc/ansible')
         self.scan_pattern = ssh_config.get('scan_pattern', '*orchestrator*.yml')
         self.connection_timeout = ssh_config.get('connection_timeout', 30)
+        self.control_path = ssh_config.get('control_path')
+        self.control_persist = ssh_config.get('control_persist', '600s')
+
+        self._ssh_service = SSHAnsibleService(SSHConfig(
+            host=self.host,
+            user=self.user,
+            port=self.port,
+            key_file=self.key_file,
+            connection_timeout=self.connection_timeout,
+            ansible_path=self.ansible_path,
+            control_path=self.control_path,
+            control_persist=self.control_persist
+        ))
 
     def _build_ssh_command(self, remote_command: list) -> list:
         """
         Формирует SSH команду для выполнения на удаленном хосте.
-        Аналог метода из SSHAnsibleService.
+        Использует сборщик SSHAnsibleService, чтобы опции ssh (мультиплексирование,
+        таймауты, проверка ключей) не расходились между двумя сервисами.
 
         Args:
             remote_command: список элементов команды для выполнения
@@ -55,27 +73,7 @@ class OrchestratorScanner:
         Returns:
             список элементов SSH команды
         """
-        ssh_cmd = ['ssh']
-
-        if self.key_file:
-            ssh_cmd.extend(['-i', self.key_file])
-
-        ssh_cmd.extend([
-            '-o', 'StrictHostKeyChecking=no',
-            '-o', 'UserKnownHostsFile=/dev/null',
-            '-o', f'ConnectTimeout={self.connection_timeout}',
-            '-p', str(self.port),
-            f'{self.user}@{self.host}'
-        ])
-
-        # Если remote_command это список с bash -c, передаем как есть
-        if isinstance(remote_command, list) and len(remote_command) == 3 and remote_command[1] == '-c':
-            ssh_cmd.extend(remote_command)
-        else:
-            # Иначе объединяем в одну команду
-            ssh_cmd.append(' '.join(str(cmd) for cmd in remote_command))
-
-        return ssh_cmd
+        return self._ssh_service.build_ssh_command(remote_command)
 
     async def _execute_ssh_command(self, command: list) -> Tuple[bool, str, str]:
         """
@@ -90,10 +88,13 @@ class OrchestratorScanner:
         ssh_cmd = self._build_ssh_command(command)
 
         try:
+            # Содержимое playbook-ов читается целиком: больший буфер потока -
+            # меньше пауз чтения из pipe
             process = await asyncio.create_subprocess_exec(
                 *ssh_cmd,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=SSHAnsibleService.STREAM_READ_LIMIT
             )
 
             try:
@@ -131,7 +132,7 @@ class OrchestratorScanner:
         # find ищет файлы с именем содержащим "orchestrator" и расширением .yml или .yaml
         # Используем exec basename для совместимости (вместо -printf)
         bash_cmd = (
-            f"cd {self.ansible_path} && "
+            f"cd {shlex.quote(self.ansible_path)} && "
             f"find . -maxdepth 1 -type f "
             f"\\( -name '*orchestrator*.yml' -o -name '*orchestrator*.yaml' \\) "
             f"-exec basename {{}} \\; 2>/dev/null || true"
@@ -139,8 +140,9 @@ class OrchestratorScanner:
 
         logger.info(f"Executing find command: {bash_cmd}")
 
-        # Важно: bash_cmd нужно обернуть в двойные кавычки как в ssh_ansible_service
-        success, stdout, stderr = await self._execute_ssh_command(['bash', '-c', f'"{bash_cmd}"'])
+        # Команду разбирает shell удаленного пользователя, запускаемый ssh:
+        # отдельный bash -c не нужен
+        success, stdout, stderr = await self._execute_ssh_command([bash_cmd])
 
         logger.info(f"Find command result - success: {success}, stdout length: {len(stdout)}, stderr: '{stderr}'")
         logger.info(f"Find stdout: '{stdout[:200]}'")  # Первые 200 символов
@@ -154,9 +156,9 @@ class OrchestratorScanner:
             logger.info("Trying to list all files in directory for debugging...")
 
             # Для отладки - показать все файлы в каталоге
-            debug_cmd = f"ls -1 {self.ansible_path}"
-            logger.info(f"Debug command: {debug_cmd}")
-            debug_success, debug_stdout, debug_stderr = await self._execute_ssh_command(['bash', '-c', f'"{debug_cmd}"'])
+            debug_cmd = ['ls', '-1', shlex.quote(self.ansible_path)]
+            logger.info(f"Debug command: {' '.join(debug_cmd)}")
+            debug_success, debug_stdout, debug_stderr = await self._execute_ssh_command(debug_cmd)
             logger.info(f"Debug success: {debug_success}, stdout length: {len(debug_stdout)}, stderr: {debug_stderr}")
 
             if debug_success and debug_stdout:
@@ -187,10 +189,7 @@ class OrchestratorScanner:
         """
         file_path = os.path.join(self.ansible_path, filename)
 
-        # Команда для чтения файла
-        bash_cmd = f"cat {file_path}"
-
-        success, stdout, stderr = await self._execute_ssh_command(['bash', '-c', f'"{bash_cmd}"'])
+        success, stdout, stderr = await self._execute_ssh_command(['cat', shlex.quote(file_path)])
 
         if not success:
             logger.error(f"Failed to read file {file_path}: {stderr}")
@@ -411,15 +410,18 @@ def scan_orchestrators(force=True):
     Returns:
         dict с результатами сканирования
     """
-    # Формируем SSH конфигурацию из Config
+    # SSH настройки берем из снимка Config, общего с SSHAnsibleService
+    default_ssh_config = get_ssh_ansible_service().ssh_config
     ssh_config = {
-        'host': getattr(Config, 'SSH_HOST', 'localhost'),
-        'user': getattr(Config, 'SSH_USER', 'ansible'),
-        'port': getattr(Config, 'SSH_PORT', 22),
-        'key_file': getattr(Config, 'SSH_KEY_FILE', None),
-        'ansible_path': getattr(Config, 'ANSIBLE_PATH', '/etc/ansible'),
+        'host': default_ssh_config.host,
+        'user': default_ssh_config.user,
+        'port': default_ssh_config.port,
+        'key_file': default_ssh_config.key_file,
+        'ansible_path': default_ssh_config.ansible_path,
         'scan_pattern': getattr(Config, 'ORCHESTRATOR_SCAN_PATTERN', '*orchestrator*.yml'),
-        'connection_timeout': getattr(Config, 'SSH_CONNECTION_TIMEOUT', 30)
+        'connection_timeout': default_ssh_config.connection_timeout,
+        'control_path': default_ssh_config.control_path,
+        'control_persist': default_ssh_config.control_persist
     }
 
     scanner = OrchestratorScanner(ssh_config)
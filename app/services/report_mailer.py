@@ -5,62 +5,102 @@ import subprocess
 import csv
 import io
 import logging
+from functools import lru_cache
 from datetime import datetime, timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from typing import List, Optional, Dict, Any
-from flask import current_app, render_template_string
+from typing import List, Optional, Dict, Any, Tuple
+from flask import current_app
 
 from app import db
 from app.models.application_instance import ApplicationInstance
 from app.models.application_version_history import ApplicationVersionHistory
 from app.models.mailing_group import MailingGroup
+from app.models.server import Server
 
 logger = logging.getLogger(__name__)
 
+# Статические части HTML-таблиц отчётов
+_CURRENT_TABLE_HEAD = """
+        <table>
+            <thead>
+                <tr>
+                    <th>Приложение</th>
+                    <th>Тип</th>
+                    <th>Сервер</th>
+                    <th>Версия</th>
+                    <th>Обновлено</th>
+                </tr>
+            </thead>
+            <tbody>
+        """
+
+_HISTORY_TABLE_HEAD = """
+        <table>
+            <thead>
+                <tr>
+                    <th>Приложение</th>
+                    <th>Сервер</th>
+                    <th>Изменение версии</th>
+                    <th>Дата</th>
+                    <th>Источник</th>
+                </tr>
+            </thead>
+            <tbody>
+        """
+
+_TABLE_TAIL = "</tbody></table>"
+
+# Таблица экранирования HTML для str.translate (один проход по строке)
+_HTML_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;'
+})
+
 
 class ReportMailerService:
     """Сервис для генерации и отправки отчётов по email"""
 
-    # HTML шаблон для отчётов
-    EMAIL_TEMPLATE = """
+    # HTML-обёртка письма (str.format: фигурные скобки CSS удвоены)
+    EMAIL_HEAD = """
 <!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
     <style>
-        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; background-color: #f5f5f5; }
-        .container { max-width: 800px; margin: 0 auto; background-color: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-        h2 { color: #333; border-bottom: 2px solid #4a5568; padding-bottom: 10px; }
-        .meta { color: #666; margin-bottom: 20px; font-size: 14px; }
-        table { border-collapse: collapse; width: 100%; margin-top: 15px; }
-        th, td { border: 1px solid #ddd; padding: 10px; text-align: left; }
-        th { background-color: #4a5568; color: white; }
-        tr:nth-child(even) { background-color: #f9f9f9; }
-        tr:hover { background-color: #f0f0f0; }
-        .footer { margin-top: 20px; padding-top: 15px; border-top: 1px solid #ddd; color: #888; font-size: 12px; }
-        .version { font-family: monospace; background-color: #e2e8f0; padding: 2px 6px; border-radius: 4px; }
-        .type-docker { background-color: #3182ce; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }
-        .type-site { background-color: #38a169; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }
-        .type-service { background-color: #805ad5; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }
-        .change-arrow { color: #4a5568; margin: 0 5px; }
+        body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; background-color: #f5f5f5; }}
+        .container {{ max-width: 800px; margin: 0 auto; background-color: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
+        h2 {{ color: #333; border-bottom: 2px solid #4a5568; padding-bottom: 10px; }}
+        .meta {{ color: #666; margin-bottom: 20px; font-size: 14px; }}
+        table {{ border-collapse: collapse; width: 100%; margin-top: 15px; }}
+        th, td {{ border: 1px solid #ddd; padding: 10px; text-align: left; }}
+        th {{ background-color: #4a5568; color: white; }}
+        tr:nth-child(even) {{ background-color: #f9f9f9; }}
+        tr:hover {{ background-color: #f0f0f0; }}
+        .footer {{ margin-top: 20px; padding-top: 15px; border-top: 1px solid #ddd; color: #888; font-size: 12px; }}
+        .version {{ font-family: monospace; background-color: #e2e8f0; padding: 2px 6px; border-radius: 4px; }}
+        .type-docker {{ background-color: #3182ce; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }}
+        .type-site {{ background-color: #38a169; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }}
+        .type-service {{ background-color: #805ad5; color: white; padding: 2px 8px; border-radius: 4px; font-size: 12px; }}
+        .change-arrow {{ color: #4a5568; margin: 0 5px; }}
     </style>
 </head>
 <body>
     <div class="container">
-        <h2>{{ title }}</h2>
+        <h2>{title}</h2>
         <div class="meta">
-            <p>Дата генерации: {{ generated_at }}</p>
-            {% if filters_info %}
-            <p>Фильтры: {{ filters_info }}</p>
-            {% endif %}
+            <p>Дата генерации: {generated_at}</p>
+            {filters_block}
         </div>
-        {{ table_html | safe }}
-        <div class="footer">
+"""
+
+    EMAIL_TAIL = """        <div class="footer">
             <p>Отчёт сгенерирован системой Application Control</p>
-            <p>Всего записей: {{ total_records }}</p>
+            <p>Всего записей: {total_records}</p>
         </div>
     </div>
 </body>
@@ -68,14 +108,23 @@ class ReportMailerService:
 """
 
     def __init__(self):
-        pass
+        # Кэш разрешённых получателей на время жизни экземпляра сервиса.
+        # Экземпляр создаётся на каждый запрос API и не должен жить дольше:
+        # кэш не инвалидируется при изменении состава групп рассылки
+        self._recipients_cache: Dict[tuple, List[str]] = {}
 
     def resolve_recipients(self, recipients: List[str]) -> List[str]:
         """
         Разрешает список получателей в email-адреса.
         Поддерживает как прямые email, так и имена групп рассылки.
+        Повторный вызов с тем же списком не обращается к БД.
         """
-        return MailingGroup.resolve_recipients(recipients)
+        key = tuple(recipients)
+        resolved = self._recipients_cache.get(key)
+        if resolved is None:
+            resolved = MailingGroup.resolve_recipients(recipients)
+            self._recipients_cache[key] = resolved
+        return list(resolved)
 
     def send_current_versions_report(
         self,
@@ -162,23 +211,7 @@ class ReportMailerService:
         period = period or {}
 
         # Определяем период
-        date_to = datetime.now()
-        period_text = 'за последний день'
-
-        if period.get('date_from'):
-            try:
-                date_from = datetime.fromisoformat(period['date_from'].replace('Z', '+00:00'))
-                if period.get('date_to'):
-                    date_to = datetime.fromisoformat(period['date_to'].replace('Z', '+00:00'))
-                period_text = f"с {date_from.strftime('%Y-%m-%d')} по {date_to.strftime('%Y-%m-%d')}"
-            except ValueError:
-                date_from = datetime.now() - timedelta(days=1)
-        elif period.get('days'):
-            days = int(period['days'])
-            date_from = datetime.now() - timedelta(days=days)
-            period_text = f'за последние {days} дней'
-        else:
-            date_from = datetime.now() - timedelta(days=1)
+        date_from, date_to, period_text = self._resolve_period(period)
 
         # Получаем данные
         data = self._get_version_history_data(filters, date_from)
@@ -225,9 +258,56 @@ class ReportMailerService:
 
         return result
 
+    def _resolve_period(self, period: Dict) -> Tuple[datetime, datetime, str]:
+        """
+        Определить границы периода отчёта.
+
+        Args:
+            period: dict с date_from/date_to (ISO формат) или days
+
+        Returns:
+            (date_from, date_to, period_text)
+        """
+        now = datetime.now()
+        default_from = now - timedelta(days=1)
+
+        if period.get('date_from'):
+            try:
+                date_from = self._parse_iso_datetime(period['date_from'])
+                date_to = self._parse_iso_datetime(period['date_to']) if period.get('date_to') else now
+            except ValueError:
+                return default_from, now, 'за последний день'
+            period_text = f"с {date_from.strftime('%Y-%m-%d')} по {date_to.strftime('%Y-%m-%d')}"
+            return date_from, date_to, period_text
+
+        if period.get('days'):
+            days = int(period['days'])
+            return now - timedelta(days=days), now, f'за последние {days} дней'
+
+        return default_from, now, 'за последний день'
+
+    @staticmethod
+    def _parse_iso_datetime(value: str) -> datetime:
+        """Разбор ISO-даты с поддержкой суффикса 'Z' (UTC)"""
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        return datetime.fromisoformat(value)
+
     def _get_current_versions_data(self, filters: Dict) -> List[Dict]:
         """Получить данные о текущих версиях"""
-        query = ApplicationInstance.query.filter(
+        # Выбираем только нужные колонки: без гидратации ORM-объектов
+        # и без ленивой загрузки app.server на каждую строку
+        query = db.session.query(
+            ApplicationInstance.instance_name,
+            ApplicationInstance.app_type,
+            ApplicationInstance.version,
+            ApplicationInstance.tag,
+            Server.name,
+            ApplicationInstance.distr_path,
+            ApplicationInstance.updated_at
+        ).outerjoin(
+            Server, ApplicationInstance.server_id == Server.id
+        ).filter(
             ApplicationInstance.deleted_at.is_(None)
         )
 
@@ -240,29 +320,40 @@ class ReportMailerService:
         if filters.get('app_type'):
             query = query.filter(ApplicationInstance.app_type == filters['app_type'])
 
-        applications = query.order_by(
+        rows = query.order_by(
             ApplicationInstance.server_id,
             ApplicationInstance.instance_name
         ).all()
 
         data = []
-        for app in applications:
+        for instance_name, app_type, version, tag, server_name, distr_path, updated_at in rows:
             data.append({
-                'instance_name': app.instance_name,
-                'app_type': app.app_type,
-                'version': app.version or app.tag or '-',
-                'server_name': app.server.name if app.server else '-',
-                'distr_path': app.distr_path or '-',
-                'updated_at': app.updated_at.strftime('%Y-%m-%d %H:%M') if app.updated_at else '-'
+                'instance_name': instance_name,
+                'app_type': app_type,
+                'version': version or tag or '-',
+                'server_name': server_name or '-',
+                'distr_path': distr_path or '-',
+                'updated_at': updated_at.strftime('%Y-%m-%d %H:%M') if updated_at else '-'
             })
 
         return data
 
     def _get_version_history_data(self, filters: Dict, date_from: datetime) -> List[Dict]:
         """Получить данные об истории изменений"""
-        query = ApplicationVersionHistory.query.join(
+        # Один запрос с JOIN вместо history.instance.server на каждую запись
+        query = db.session.query(
+            ApplicationInstance.instance_name,
+            Server.name,
+            ApplicationVersionHistory.old_version,
+            ApplicationVersionHistory.new_version,
+            ApplicationVersionHistory.changed_at,
+            ApplicationVersionHistory.changed_by,
+            ApplicationVersionHistory.change_source
+        ).join(
             ApplicationInstance,
             ApplicationVersionHistory.instance_id == ApplicationInstance.id
+        ).outerjoin(
+            Server, ApplicationInstance.server_id == Server.id
         ).filter(
             ApplicationVersionHistory.changed_at >= date_from
         )
@@ -273,61 +364,67 @@ class ReportMailerService:
         if filters.get('catalog_ids'):
             query = query.filter(ApplicationInstance.catalog_id.in_(filters['catalog_ids']))
 
-        history_records = query.order_by(
+        rows = query.order_by(
             ApplicationVersionHistory.changed_at.desc()
         ).limit(1000).all()
 
         data = []
-        for history in history_records:
+        for instance_name, server_name, old_version, new_version, changed_at, changed_by, change_source in rows:
             data.append({
-                'instance_name': history.instance.instance_name if history.instance else '-',
-                'server_name': history.instance.server.name if history.instance and history.instance.server else '-',
-                'old_version': history.old_version or '-',
-                'new_version': history.new_version or '-',
-                'changed_at': history.changed_at.strftime('%Y-%m-%d %H:%M') if history.changed_at else '-',
-                'changed_by': history.changed_by or '-',
-                'change_source': history.change_source or '-'
+                'instance_name': instance_name or '-',
+                'server_name': server_name or '-',
+                'old_version': old_version or '-',
+                'new_version': new_version or '-',
+                'changed_at': changed_at.strftime('%Y-%m-%d %H:%M') if changed_at else '-',
+                'changed_by': changed_by or '-',
+                'change_source': change_source or '-'
             })
 
         return data
 
     def _generate_current_versions_html(self, data: List[Dict], filters: Dict) -> str:
         """Генерировать HTML для отчёта о текущих версиях"""
-        table_html = """
-        <table>
-            <thead>
-                <tr>
-                    <th>Приложение</th>
-                    <th>Тип</th>
-                    <th>Сервер</th>
-                    <th>Версия</th>
-                    <th>Обновлено</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
+        parts = [_CURRENT_TABLE_HEAD]
 
-        for row in data:
-            type_class = f"type-{row['app_type']}" if row['app_type'] else ""
-            table_html += f"""
+        # Типов приложений единицы: класс и подпись считаем один раз на тип
+        type_cache = {}
+
+        # Большие выборки не встраиваем в тело письма целиком — полные данные в CSV
+        row_cap = current_app.config.get('REPORT_HTML_ROW_CAP', 500)
+
+        for row in data[:row_cap]:
+            app_type = row['app_type']
+            type_parts = type_cache.get(app_type)
+            if type_parts is None:
+                type_label = self._escape_html(app_type)
+                type_parts = (f"type-{type_label}" if app_type else "", type_label)
+                type_cache[app_type] = type_parts
+            type_class, type_label = type_parts
+
+            parts.append(f"""
                 <tr>
                     <td>{self._escape_html(row['instance_name'])}</td>
-                    <td><span class="{type_class}">{self._escape_html(row['app_type'])}</span></td>
+                    <td><span class="{type_class}">{type_label}</span></td>
                     <td>{self._escape_html(row['server_name'])}</td>
                     <td><span class="version">{self._escape_html(row['version'])}</span></td>
                     <td>{row['updated_at']}</td>
                 </tr>
-            """
+            """)
+
+        if len(data) > row_cap:
+            parts.append(
+                f'<tr><td colspan="5">… ещё {len(data) - row_cap} строк, '
+                f'полные данные во вложенном CSV</td></tr>'
+            )
 
-        table_html += "</tbody></table>"
+        parts.append(_TABLE_TAIL)
+        table_html = ''.join(parts)
 
         # Формируем информацию о фильтрах
         filters_info = self._format_filters_info(filters) if filters else None
 
-        return render_template_string(
-            self.EMAIL_TEMPLATE,
+        return self._render_email(
             title="Текущие версии приложений",
-            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             table_html=table_html,
             total_records=len(data),
             filters_info=filters_info
@@ -335,23 +432,10 @@ class ReportMailerService:
 
     def _generate_version_history_html(self, data: List[Dict], filters: Dict, period_text: str) -> str:
         """Генерировать HTML для отчёта об истории изменений"""
-
-        table_html = """
-        <table>
-            <thead>
-                <tr>
-                    <th>Приложение</th>
-                    <th>Сервер</th>
-                    <th>Изменение версии</th>
-                    <th>Дата</th>
-                    <th>Источник</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
+        parts = [_HISTORY_TABLE_HEAD]
 
         for row in data:
-            table_html += f"""
+            parts.append(f"""
                 <tr>
                     <td>{self._escape_html(row['instance_name'])}</td>
                     <td>{self._escape_html(row['server_name'])}</td>
@@ -363,49 +447,66 @@ class ReportMailerService:
                     <td>{row['changed_at']}</td>
                     <td>{self._escape_html(row['changed_by'])}</td>
                 </tr>
-            """
+            """)
 
-        table_html += "</tbody></table>"
+        parts.append(_TABLE_TAIL)
+        table_html = ''.join(parts)
 
         filters_info = self._format_filters_info(filters) if filters else None
 
-        return render_template_string(
-            self.EMAIL_TEMPLATE,
+        return self._render_email(
             title=f"История изменений версий {period_text}",
-            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             table_html=table_html,
             total_records=len(data),
             filters_info=filters_info
         )
 
-    def _generate_current_versions_csv(self, data: List[Dict]) -> str:
-        """Генерировать CSV для отчёта о текущих версиях"""
-        output = io.StringIO()
-        output.write('\ufeff')  # BOM для Excel
+    def _render_email(
+        self,
+        title: str,
+        table_html: str,
+        total_records: int,
+        filters_info: Optional[str] = None
+    ) -> str:
+        """Собрать HTML письма вокруг готовой таблицы (без Jinja)"""
+        filters_block = f"<p>Фильтры: {self._escape_html(filters_info)}</p>" if filters_info else ''
+
+        head = self.EMAIL_HEAD.format(
+            title=self._escape_html(title),
+            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            filters_block=filters_block
+        )
+        return head + table_html + self.EMAIL_TAIL.format(total_records=total_records)
 
-        writer = csv.DictWriter(output, fieldnames=[
+    def _generate_current_versions_csv(self, data: List[Dict]) -> bytes:
+        """Генерировать CSV для отчёта о текущих версиях"""
+        return self._generate_csv(data, [
             'instance_name', 'app_type', 'version',
             'server_name', 'distr_path', 'updated_at'
-        ], delimiter=';')
-        writer.writeheader()
-        writer.writerows(data)
+        ])
 
-        return output.getvalue()
-
-    def _generate_version_history_csv(self, data: List[Dict]) -> str:
+    def _generate_version_history_csv(self, data: List[Dict]) -> bytes:
         """Генерировать CSV для отчёта об истории изменений"""
-        output = io.StringIO()
-        output.write('\ufeff')  # BOM для Excel
-
-        writer = csv.DictWriter(output, fieldnames=[
+        return self._generate_csv(data, [
             'instance_name', 'server_name',
             'old_version', 'new_version',
             'changed_at', 'changed_by', 'change_source'
-        ], delimiter=';')
+        ])
+
+    def _generate_csv(self, data: List[Dict], fieldnames: List[str]) -> bytes:
+        """Записать строки в CSV сразу в UTF-8 байты (готово для вложения)"""
+        buffer = io.BytesIO()
+        buffer.write(b'\xef\xbb\xbf')  # BOM для Excel
+
+        wrapper = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+        writer = csv.DictWriter(wrapper, fieldnames=fieldnames, delimiter=';')
         writer.writeheader()
         writer.writerows(data)
+        wrapper.flush()
 
-        return output.getvalue()
+        content = buffer.getvalue()
+        wrapper.detach()
+        return content
 
     def _send_email(
         self,
@@ -421,7 +522,7 @@ class ReportMailerService:
             to: Список email-адресов получателей
             subject: Тема письма
             html_body: HTML тело письма
-            attachments: Список вложений
+            attachments: Список вложений (content — bytes или str)
 
         Returns:
             Результат отправки
@@ -451,7 +552,10 @@ class ReportMailerService:
             if attachments:
                 for attachment in attachments:
                     part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment['content'].encode('utf-8'))
+                    content = attachment['content']
+                    if isinstance(content, str):
+                        content = content.encode('utf-8')
+                    part.set_payload(content)
                     encoders.encode_base64(part)
                     part.add_header(
                         'Content-Disposition',
@@ -459,18 +563,17 @@ class ReportMailerService:
                     )
                     msg.attach(part)
 
-            # Отправляем через sendmail
-            process = subprocess.Popen(
+            # Отправляем через sendmail (stdout не используется)
+            process = subprocess.run(
                 [sendmail_path, '-t', '-oi'],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+                input=msg.as_string().encode('utf-8'),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=False
             )
 
-            stdout, stderr = process.communicate(msg.as_string().encode('utf-8'))
-
             if process.returncode != 0:
-                error_msg = stderr.decode('utf-8') if stderr else 'Unknown error'
+                error_msg = process.stderr.decode('utf-8') if process.stderr else 'Unknown error'
                 logger.error(f"Sendmail error: {error_msg}")
                 return {
                     'success': False,
@@ -500,19 +603,30 @@ class ReportMailerService:
         """Экранирование HTML символов"""
         if text is None:
             return ''
-        return str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+        return str(text).translate(_HTML_ESCAPE_TABLE)
 
-    def _format_filters_info(self, filters: Dict) -> str:
+    def _format_filters_info(self, filters: Dict) -> Optional[str]:
         """Форматировать информацию о фильтрах"""
-        parts = []
-        if filters.get('server_ids'):
-            parts.append(f"Серверы: {len(filters['server_ids'])} выбрано")
-        if filters.get('catalog_ids'):
-            parts.append(f"Приложения: {len(filters['catalog_ids'])} выбрано")
-        if filters.get('app_type'):
-            parts.append(f"Тип: {filters['app_type']}")
-        return ', '.join(parts) if parts else None
+        app_type = filters.get('app_type')
+        return _format_filters_info_cached(
+            len(filters.get('server_ids') or ()),
+            len(filters.get('catalog_ids') or ()),
+            str(app_type) if app_type else None
+        )
 
 
-# Создаём экземпляр сервиса
-report_mailer = ReportMailerService()
+@lru_cache(maxsize=128)
+def _format_filters_info_cached(
+    servers_count: int,
+    catalogs_count: int,
+    app_type: Optional[str]
+) -> Optional[str]:
+    """Строка с описанием фильтров; кэшируется для повторяющихся наборов фильтров"""
+    parts = []
+    if servers_count:
+        parts.append(f"Серверы: {servers_count} выбрано")
+    if catalogs_count:
+        parts.append(f"Приложения: {catalogs_count} выбрано")
+    if app_type:
+        parts.append(f"Тип: {app_type}")
+    return ', '.join(parts) if parts else None
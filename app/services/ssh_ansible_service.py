@@ -1,12 +1,22 @@
 import asyncio
+import atexit
+import json
 import logging
 import os
 import re
+import shlex
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple, Optional, Dict, Any, List
+from typing import Tuple, Optional, Dict, Any, List, Callable, Awaitable
 from dataclasses import dataclass
+from functools import lru_cache
 from enum import Enum
 
+from flask import current_app, has_app_context
+
 from app import db
 from app.models.event import Event
 from app.config import Config
@@ -22,7 +32,7 @@ class PlaybookStage(Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
-@dataclass
+@dataclass(frozen=True)
 class SSHConfig:
     """Конфигурация SSH-соединения"""
     host: str
@@ -33,20 +43,72 @@ class SSHConfig:
     connection_timeout: int = 30
     command_timeout: int = 300
     ansible_path: str = "/etc/ansible"
+    control_path: Optional[str] = None  # Сокет ControlMaster (None - без мультиплексирования)
+    control_persist: str = "600s"
+    ansible_pipelining: bool = True
+    ansible_ssh_args: Optional[str] = None
 
-@dataclass
+@dataclass(frozen=True)
 class PlaybookParameter:
     """Параметр playbook"""
     name: str  # Имя параметра
     value: Optional[str] = None  # Значение (None для динамических параметров)
     is_custom: bool = False  # True для кастомных параметров с явным значением
 
-@dataclass
+@dataclass(frozen=True)
 class PlaybookConfig:
     """Конфигурация playbook с параметрами"""
     path: str  # Путь к playbook файлу
     parameters: List[PlaybookParameter]  # Список параметров (динамических и кастомных)
 
+class _BatchedLog:
+    """
+    Буфер сообщений для вывода в лог одной записью: сброс при накоплении
+    batch_size сообщений или через flush_interval секунд после первого
+    """
+
+    def __init__(self, level: int, header: str, batch_size: int = 64, flush_interval: float = 0.25):
+        self.level = level
+        self.header = header
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._messages: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def add(self, message: str):
+        self._messages.append(message)
+        if len(self._messages) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._messages:
+            logger.log(self.level, "%s:\n%s", self.header, "\n".join(self._messages))
+            self._messages.clear()
+
+def _build_default_ssh_config() -> SSHConfig:
+    """Снимок SSH-настроек из Config (значения Config фиксируются при импорте)"""
+    return SSHConfig(
+        host=getattr(Config, 'SSH_HOST', 'localhost'),
+        user=getattr(Config, 'SSH_USER', 'ansible'),
+        port=getattr(Config, 'SSH_PORT', 22),
+        key_file=getattr(Config, 'SSH_KEY_FILE', None),
+        known_hosts_file=getattr(Config, 'SSH_KNOWN_HOSTS_FILE', None),
+        connection_timeout=getattr(Config, 'SSH_CONNECTION_TIMEOUT', 30),
+        command_timeout=getattr(Config, 'SSH_COMMAND_TIMEOUT', 300),
+        ansible_path=getattr(Config, 'ANSIBLE_PATH', '/etc/ansible'),
+        control_path=getattr(Config, 'SSH_CONTROL_PATH', None),
+        control_persist=getattr(Config, 'SSH_CONTROL_PERSIST', '600s'),
+        ansible_pipelining=getattr(Config, 'ANSIBLE_PIPELINING', True),
+        ansible_ssh_args=getattr(Config, 'ANSIBLE_SSH_ARGS', None)
+    )
+
+_DEFAULT_SSH_CONFIG = _build_default_ssh_config()
+
 class SSHAnsibleService:
     """
     Сервис для запуска Ansible playbook-ов через SSH с поддержкой параметров
@@ -74,11 +136,50 @@ class SSHAnsibleService:
         'haproxy_api_url': 'URL HAProxy API для orchestrator (например: http://10.0.0.1:5000/haproxy/default)',
         'haproxy_backend': 'Имя backend в HAProxy (для orchestrator)'
     }
+
+    # Множество имен для проверки принадлежности при валидации
+    _AVAILABLE_VARIABLES_SET = frozenset(AVAILABLE_VARIABLES)
     
     # Регулярные выражения для безопасной валидации кастомных параметров
     SAFE_PARAM_NAME_PATTERN = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
     SAFE_PARAM_VALUE_PATTERN = re.compile(r'^[a-zA-Z0-9_\-\./:\@\=\s]+$')
 
+    # Маркеры строк вывода Ansible одним выражением (порядок альтернатив = приоритет:
+    # Gathering Facts проверяется раньше общего TASK). Все маркеры Ansible печатает
+    # с начала строки, поэтому выражение применяется через match.
+    # Маркеры ASCII, поэтому поиск идет по байтам - декодируются только совпавшие строки
+    ANSIBLE_LINE_PATTERN = re.compile(
+        rb'(?P<play>PLAY \[)'
+        rb'|(?P<gathering_facts>TASK \[Gathering Facts\])'
+        rb'|TASK \[(?P<task>[^\]]*)'
+        rb'|RUNNING HANDLER \[(?P<handler>[^\]]*)'
+        rb'|(?P<recap>PLAY RECAP)'
+        rb'|(?P<error>fatal:|ERROR!)'
+        rb'|(?P<ok>ok:)'
+        rb'|(?P<changed>changed:)'
+        rb'|(?P<skipped>skipping:)'
+    )
+    # Первые байты маркеров: остальные строки (JSON-вывод -v и т.п.) отсекаются без regex
+    ANSIBLE_MARKER_FIRST_BYTES = frozenset(b'PTRfEocs')
+    ANSIBLE_RESULT_STAGES = {
+        'ok': 'task_ok',
+        'changed': 'task_changed',
+        'skipped': 'task_skipped'
+    }
+
+    # Маркер в stdout: SSH-соединение установлено, удаленная команда запущена
+    SSH_READY_MARKER = 'AC_SSH_READY'
+    _SSH_READY_MARKER_BYTES = SSH_READY_MARKER.encode()
+
+    # Маркер в stderr: playbook отсутствует на удаленном хосте
+    PLAYBOOK_NOT_FOUND_MARKER = 'AC_PLAYBOOK_NOT_FOUND'
+
+    # Сколько последних строк stderr хранится для сообщения об ошибке
+    OUTPUT_TAIL_LINES = getattr(Config, 'ANSIBLE_OUTPUT_TAIL_LINES', 500)
+
+    # Лимит буфера StreamReader для построчного чтения вывода Ansible (1 МБ)
+    STREAM_READ_LIMIT = 1 << 20
+
     # Этапы Ansible, которые отслеживаются для отображения прогресса
     TRACKABLE_STAGES = ('task', 'handler', 'gathering_facts')
 
@@ -88,10 +189,63 @@ class SSHAnsibleService:
     # Хранилище прогресса выполнения задач (task_id -> {current_task, stage, updated_at})
     _task_progress: Dict[str, dict] = {}
 
+    # Кэш ID серверов по имени (server_name -> (server_id, время записи)).
+    # Порядок ключей dict - порядок использования: при переполнении вытесняется самый старый
+    _server_id_cache: Dict[str, Tuple[int, float]] = {}
+    SERVER_ID_CACHE_TTL = 60  # секунды
+    SERVER_ID_CACHE_MAXSIZE = 256
+
+    # Отдельный пул для записи в БД: запись событий не конкурирует за потоки
+    # пула по умолчанию и не задерживает другие to_thread-вызовы.
+    # Создается при первой записи (см. _get_db_executor), закрывается при выходе
+    _db_executor: Optional[ThreadPoolExecutor] = None
+    _db_executor_lock = threading.Lock()
+
+    # Листинг playbook-ов ansible каталога ((host, port, ansible_path) -> (время записи, результат))
+    _playbooks_cache: Dict[Tuple[str, int, str], Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+    PLAYBOOKS_CACHE_TTL = getattr(Config, 'PLAYBOOKS_CACHE_TTL', 60)  # секунды
+    PLAYBOOK_EXTENSIONS = ('.yml', '.yaml')
+
     def __init__(self, ssh_config: SSHConfig):
         self.ssh_config = ssh_config
         self.current_stage = PlaybookStage.CONNECTING
 
+        # Каталог для сокета ControlMaster должен существовать до первого вызова ssh
+        if ssh_config.control_path:
+            control_dir = os.path.dirname(ssh_config.control_path)
+            if control_dir:
+                try:
+                    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+                except OSError as e:
+                    logger.warning(f"Не удалось создать каталог для ControlPath {control_dir}: {e}")
+
+        # Опции ssh зависят только от неизменяемой конфигурации - собираем один раз
+        self._ssh_prefix = tuple(self._build_base_ssh_args())
+        # Каталог playbook-ов без завершающего '/' для сборки и сравнения путей
+        self._ansible_dir = ssh_config.ansible_path.rstrip('/')
+
+    @classmethod
+    def _resolve_server_id(cls, server_name: str) -> Optional[int]:
+        """
+        Получает ID сервера по имени.
+        Результат кэшируется на SERVER_ID_CACHE_TTL секунд: серверы меняются редко,
+        а запрос выполняется на каждое обновление/управление приложением.
+        """
+        cached = cls._server_id_cache.pop(server_name, None)
+        now = time.monotonic()
+        if cached and now - cached[1] < cls.SERVER_ID_CACHE_TTL:
+            cls._server_id_cache[server_name] = cached  # переносим в конец как недавно использованный
+            return cached[0]
+
+        from app.models.server import Server
+
+        server_id = db.session.query(Server.id).filter_by(name=server_name).scalar()
+        if server_id is not None:
+            if len(cls._server_id_cache) >= cls.SERVER_ID_CACHE_MAXSIZE:
+                cls._server_id_cache.pop(next(iter(cls._server_id_cache)), None)
+            cls._server_id_cache[server_name] = (server_id, now)
+        return server_id
+
     @classmethod
     def cancel_task(cls, task_id: str) -> Tuple[bool, str]:
         """
@@ -151,17 +305,7 @@ class SSHAnsibleService:
     @classmethod
     def from_config(cls) -> 'SSHAnsibleService':
         """Создает экземпляр из конфигурации приложения"""
-        ssh_config = SSHConfig(
-            host=getattr(Config, 'SSH_HOST', 'localhost'),
-            user=getattr(Config, 'SSH_USER', 'ansible'),
-            port=getattr(Config, 'SSH_PORT', 22),
-            key_file=getattr(Config, 'SSH_KEY_FILE', None),
-            known_hosts_file=getattr(Config, 'SSH_KNOWN_HOSTS_FILE', None),
-            connection_timeout=getattr(Config, 'SSH_CONNECTION_TIMEOUT', 30),
-            command_timeout=getattr(Config, 'SSH_COMMAND_TIMEOUT', 300),
-            ansible_path=getattr(Config, 'ANSIBLE_PATH', '/etc/ansible')
-        )
-        return cls(ssh_config)
+        return cls(_DEFAULT_SSH_CONFIG)
     
     def parse_playbook_config(self, playbook_path_with_params: str) -> PlaybookConfig:
         """
@@ -181,15 +325,19 @@ class SSHAnsibleService:
             "/playbook.yml {server} {onlydeliver=true}" -> смешанные параметры
             "/playbook.yml {env=prod} {timeout=30}" -> параметры с явными значениями
         """
-        # Регулярное выражение для поиска параметров в фигурных скобках
-        # Поддерживает как {param}, так и {param=value}
-        param_pattern = r'\{([^}]+)\}'
-        
-        # Находим все параметры
-        param_matches = re.findall(param_pattern, playbook_path_with_params)
-        
-        parameters = []
-        for match in param_matches:
+        cached = self._parse_playbook_config_cached(playbook_path_with_params)
+        # Копия списка: кэшированный экземпляр не должен меняться вызывающим кодом
+        return PlaybookConfig(path=cached.path, parameters=list(cached.parameters))
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _parse_playbook_config_cached(playbook_path_with_params: str) -> PlaybookConfig:
+        """Разбор строки playbook с параметрами (кэшируется по исходной строке)"""
+        path_pieces, raw_params = SSHAnsibleService._split_params(playbook_path_with_params)
+        # Параметры по имени: повтор не дублирует запись, а заменяет значение
+        # (как и раньше при сборке extra_vars), сохраняя позицию первого вхождения
+        parameters: Dict[str, PlaybookParameter] = {}
+        for match in raw_params:
             # Проверяем, содержит ли параметр знак равенства
             if '=' in match:
                 # Кастомный параметр с явным значением
@@ -201,35 +349,66 @@ class SSHAnsibleService:
                 if param_value.lower() in ['true', 'false']:
                     param_value = param_value.lower()
                 
-                parameters.append(PlaybookParameter(
+                parameters[param_name] = PlaybookParameter(
                     name=param_name,
                     value=param_value,
                     is_custom=True
-                ))
-                logger.info(f"Обнаружен кастомный параметр: {param_name}={param_value}")
+                )
+                logger.debug("Обнаружен кастомный параметр: %s=%s", param_name, param_value)
             else:
                 # Динамический параметр (значение из контекста)
                 param_name = match.strip()
-                parameters.append(PlaybookParameter(
+                parameters[param_name] = PlaybookParameter(
                     name=param_name,
                     value=None,
                     is_custom=False
-                ))
-                logger.info(f"Обнаружен динамический параметр: {param_name}")
-        
-        # Удаляем параметры из пути, оставляя только путь к файлу
-        playbook_path = re.sub(param_pattern, '', playbook_path_with_params).strip()
+                )
+                logger.debug("Обнаружен динамический параметр: %s", param_name)
         
-        # Убираем лишние пробелы
-        playbook_path = ' '.join(playbook_path.split())
+        # Путь без параметров: пробелы, разделявшие параметры, остаются только по краям
+        playbook_path = ''.join(path_pieces).strip()
+        if ' ' in playbook_path:
+            logger.warning("Пробелы в пути к playbook после удаления параметров: %r", playbook_path)
+            playbook_path = playbook_path.replace(' ', '')
         
-        logger.info(f"Parsed playbook config: path='{playbook_path}', parameters={[p.name for p in parameters]}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Parsed playbook config: path='%s', parameters=%s", playbook_path, list(parameters))
         
         return PlaybookConfig(
             path=playbook_path,
-            parameters=parameters
+            parameters=list(parameters.values())
         )
     
+    @staticmethod
+    def _split_params(text: str) -> Tuple[List[str], List[str]]:
+        """
+        Разделяет строку на фрагменты пути и параметры в фигурных скобках:
+        {param} или {param=value}. Пустые скобки {} параметром не считаются
+        и остаются в пути.
+        
+        Returns:
+            Кортеж (фрагменты пути, содержимое скобок параметров)
+        """
+        path_pieces = []
+        params = []
+        start = 0
+        pos = 0
+        while True:
+            open_pos = text.find('{', pos)
+            if open_pos < 0:
+                break
+            close_pos = text.find('}', open_pos + 1)
+            if close_pos < 0:
+                break
+            if close_pos == open_pos + 1:
+                pos = close_pos + 1
+                continue
+            path_pieces.append(text[start:open_pos])
+            params.append(text[open_pos + 1:close_pos])
+            start = pos = close_pos + 1
+        path_pieces.append(text[start:])
+        return path_pieces, params
+    
     def validate_parameters(self, parameters: List[PlaybookParameter]) -> Tuple[bool, List[str]]:
         """
         Валидирует параметры playbook
@@ -243,49 +422,43 @@ class SSHAnsibleService:
             Tuple[bool, List[str]]: (все параметры валидны, список невалидных параметров)
         """
         invalid_params = []
-        
+
         for param in parameters:
-            if param.is_custom:
-                # Валидация кастомных параметров
-                # Проверяем безопасность имени параметра
-                if not self.SAFE_PARAM_NAME_PATTERN.match(param.name):
-                    invalid_params.append(f"{param.name} (небезопасное имя параметра)")
-                    logger.warning(f"Unsafe custom parameter name: '{param.name}'")
-                    continue
-                
-                # Проверяем безопасность значения параметра
-                if param.value and not self.SAFE_PARAM_VALUE_PATTERN.match(param.value):
-                    invalid_params.append(f"{param.name}={param.value} (небезопасное значение)")
-                    logger.warning(f"Unsafe custom parameter value: '{param.name}={param.value}'")
-                    continue
-                    
-                logger.info(f"Custom parameter '{param.name}={param.value}' validated successfully")
-            else:
-                # Валидация динамических параметров
-                if param.name not in self.AVAILABLE_VARIABLES:
-                    invalid_params.append(param.name)
-                    logger.warning(f"Unknown dynamic parameter '{param.name}' in playbook path")
-        
+            error = self._validate_parameter(param.name, param.value, param.is_custom)
+            if error:
+                invalid_params.append(error)
+                logger.warning("Invalid playbook parameter: %s", error)
+            elif param.is_custom:
+                logger.debug("Custom parameter '%s=%s' validated successfully", param.name, param.value)
+
         return len(invalid_params) == 0, invalid_params
-    
-    def sanitize_value(self, value: str) -> str:
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _validate_parameter(name: str, value: Optional[str], is_custom: bool) -> Optional[str]:
         """
-        Санитизация значения для безопасной передачи в ansible
-        
-        Args:
-            value: Исходное значение
-            
+        Проверка одного параметра (кэшируется по (name, value, is_custom))
+
         Returns:
-            str: Санитизированное значение
+            Optional[str]: описание ошибки или None, если параметр валиден
         """
-        # Экранируем специальные символы для shell
-        value = value.replace('"', '\\"')
-        value = value.replace('$', '\\$')
-        value = value.replace('`', '\\`')
-        value = value.replace('\\', '\\\\')
-        
-        return value
-    
+        if is_custom:
+            # Проверяем безопасность имени параметра
+            if not SSHAnsibleService.SAFE_PARAM_NAME_PATTERN.match(name):
+                return f"{name} (небезопасное имя параметра)"
+
+            # Проверяем безопасность значения параметра
+            if value and not SSHAnsibleService.SAFE_PARAM_VALUE_PATTERN.match(value):
+                return f"{name}={value} (небезопасное значение)"
+
+            return None
+
+        # Динамические параметры должны быть известны
+        if name not in SSHAnsibleService._AVAILABLE_VARIABLES_SET:
+            return name
+
+        return None
+
     def build_context_vars(self,
                           server_name: str,
                           app_name: str,
@@ -339,32 +512,32 @@ class SSHAnsibleService:
         elif distr_url:
             # Если image_url не задан явно, используем distr_url как алиас
             context_vars['image_url'] = distr_url
-            logger.info(f"image_url установлен как алиас для distr_url: {distr_url}")
+            logger.info("image_url установлен как алиас для distr_url: %s", distr_url)
 
         # Добавляем параметры для orchestrator playbook
         if orchestrator_app_instances:
             context_vars['app_instances'] = orchestrator_app_instances
-            logger.info(f"Orchestrator app_instances: {orchestrator_app_instances}")
+            logger.info("Orchestrator app_instances: %s", orchestrator_app_instances)
 
         if orchestrator_drain_delay is not None:
             context_vars['drain_delay'] = str(orchestrator_drain_delay)
-            logger.info(f"Orchestrator drain_delay: {orchestrator_drain_delay}s")
+            logger.info("Orchestrator drain_delay: %ss", orchestrator_drain_delay)
 
         if orchestrator_update_playbook:
             context_vars['update_playbook'] = orchestrator_update_playbook
-            logger.info(f"Orchestrator update_playbook: {orchestrator_update_playbook}")
+            logger.info("Orchestrator update_playbook: %s", orchestrator_update_playbook)
 
         if orchestrator_haproxy_api_url:
             context_vars['haproxy_api_url'] = orchestrator_haproxy_api_url
-            logger.info(f"Orchestrator haproxy_api_url: {orchestrator_haproxy_api_url}")
+            logger.info("Orchestrator haproxy_api_url: %s", orchestrator_haproxy_api_url)
 
         if orchestrator_haproxy_backend:
             context_vars['haproxy_backend'] = orchestrator_haproxy_backend
-            logger.info(f"Orchestrator haproxy_backend: {orchestrator_haproxy_backend}")
+            logger.info("Orchestrator haproxy_backend: %s", orchestrator_haproxy_backend)
 
         if orchestrator_wait_after_update is not None:
             context_vars['wait_after_update'] = str(orchestrator_wait_after_update)
-            logger.info(f"Orchestrator wait_after_update: {orchestrator_wait_after_update}s")
+            logger.info("Orchestrator wait_after_update: %ss", orchestrator_wait_after_update)
 
         return context_vars
     
@@ -382,41 +555,41 @@ class SSHAnsibleService:
         Returns:
             Dict[str, str]: Словарь extra_vars для передачи в ansible-playbook
         """
-        extra_vars = {}
-        
-        # Обрабатываем каждый параметр из конфигурации
-        for param in playbook_config.parameters:
-            if param.is_custom:
-                # Кастомный параметр - используем явное значение
-                if param.value is not None:
-                    # Санитизируем значение
-                    sanitized_value = self.sanitize_value(str(param.value))
-                    extra_vars[param.name] = sanitized_value
-                    logger.info(f"Added custom parameter: {param.name}={sanitized_value}")
-                else:
-                    # Кастомный параметр без значения - используем пустую строку
-                    extra_vars[param.name] = ""
-                    logger.warning(f"Custom parameter '{param.name}' has no value, using empty string")
-            else:
-                # Динамический параметр - берем из контекста
-                if param.name in context_vars:
-                    value = context_vars[param.name]
-                    if value is not None and value != "":
-                        extra_vars[param.name] = str(value)
-                        logger.info(f"Added dynamic parameter from context: {param.name}={value}")
-                    else:
-                        # Пропускаем параметры с None или пустым значением
-                        # Плейбук должен обработать их отсутствие через defaults
-                        logger.warning(f"Dynamic parameter '{param.name}' has empty value, skipping")
-                else:
-                    # Параметр не найден в context - пропускаем
-                    # Плейбук должен использовать свои defaults или пропустить шаги
-                    logger.warning(f"Dynamic parameter '{param.name}' not found in context, skipping")
-        
-        logger.info(f"Built extra_vars with {len(extra_vars)} parameters: {list(extra_vars.keys())}")
-        
+        # Playbook без параметров (типичные start/stop): ни обхода, ни записей в лог
+        if not playbook_config.parameters:
+            return {}
+
+        get_context_value = context_vars.get
+        extra_vars = {
+            param.name: value
+            for param in playbook_config.parameters
+            if (value := self._extra_var_value(param, get_context_value)) is not None
+        }
+
+        # Одна сводная запись в лог вместо сообщения на каждый параметр;
+        # повторный обход параметров - только если какие-то из них пропущены
+        if len(extra_vars) < len(playbook_config.parameters):
+            skipped = [param.name for param in playbook_config.parameters if param.name not in extra_vars]
+            if skipped:
+                logger.warning("Dynamic parameters without value in context, skipped: %s", skipped)
+
+        logger.info("Built extra_vars with %d parameters: %s", len(extra_vars), list(extra_vars))
+
         return extra_vars
-    
+
+    def _extra_var_value(self, param: PlaybookParameter,
+                         get_context_value: Callable[[str], Optional[str]]) -> Optional[str]:
+        """Значение параметра для extra_vars (None - параметр пропускается)"""
+        if param.is_custom:
+            # Кастомный параметр - явное значение (пустая строка, если не задано)
+            # Экранирование для shell выполняется один раз для всего JSON в build_ansible_command
+            return str(param.value) if param.value is not None else ""
+
+        # Динамический параметр - из контекста. None и пустые значения пропускаются,
+        # плейбук должен обработать их отсутствие через defaults
+        value = get_context_value(param.name)
+        return str(value) if value is not None and value != "" else None
+
     def build_ansible_command(self,
                             playbook_path: str,
                             extra_vars: Dict[str, str],
@@ -424,6 +597,14 @@ class SSHAnsibleService:
                             verbose: bool = True) -> List[str]:
         """
         Формирует команду для запуска ansible-playbook
+
+        Перед ansible-playbook выставляются переменные окружения транспорта:
+        ANSIBLE_PIPELINING (одна SSH-сессия на задачу) и, если задан в конфиге,
+        ANSIBLE_SSH_ARGS. Переменные окружения имеют приоритет над pipelining и
+        ssh_args из ansible.cfg; пустой ANSIBLE_SSH_ARGS не передается, и ssh_args
+        берутся из ansible.cfg. Pipelining не работает с sudo, если в sudoers на
+        управляемых хостах включен requiretty, - в этом случае его нужно
+        отключить через ANSIBLE_PIPELINING=false.
         
         Args:
             playbook_path: Путь к playbook файлу
@@ -432,31 +613,58 @@ class SSHAnsibleService:
             verbose: Включить verbose вывод
             
         Returns:
-            List[str]: Список элементов команды
+            List[str]: Список элементов команды. Элементы уже экранированы для
+                       удаленного shell, команда собирается через ' '.join
         """
-        cmd = [
-            'cd', self.ssh_config.ansible_path, '&&',
-            'ansible-playbook',
-            playbook_path
-        ]
+        cmd = ['cd', shlex.quote(self.ssh_config.ansible_path), '&&']
+
+        if self.ssh_config.ansible_pipelining:
+            cmd.append('ANSIBLE_PIPELINING=True')
+
+        if self.ssh_config.ansible_ssh_args:
+            cmd.append(f'ANSIBLE_SSH_ARGS={shlex.quote(self.ssh_config.ansible_ssh_args)}')
+
+        cmd.extend(['ansible-playbook', shlex.quote(playbook_path)])
         
         # Добавляем inventory если указан
         if inventory:
-            cmd.extend(['-i', inventory])
+            cmd.extend(['-i', shlex.quote(inventory)])
         
-        # Добавляем extra vars
-        for key, value in extra_vars.items():
-            # Значение уже санитизировано в build_extra_vars
-            cmd.extend(['-e', f'{key}="{value}"'])
+        # Все extra vars одним JSON-документом: один аргумент и одно экранирование
+        # для shell вместо пары -e key="value" на каждую переменную
+        if extra_vars:
+            cmd.extend(['-e', shlex.quote(json.dumps(extra_vars))])
         
         # Добавляем verbose если нужно
         if verbose:
             cmd.append('-v')
         
-        logger.info(f"Built ansible command with {len(extra_vars)} variables")
+        logger.info("Built ansible command with %d variables", len(extra_vars))
         
         return cmd
     
+    def build_playbook_full_path(self, playbook_path: str) -> str:
+        """Полный путь к playbook внутри ansible_path (ведущий '/' игнорируется)"""
+        return f"{self._ansible_dir}/{playbook_path.lstrip('/')}"
+
+    def _wrap_remote_command(self, playbook_full_path: str, ansible_cmd: List[str]) -> List[str]:
+        """
+        Собирает одну удаленную команду вместо трех отдельных SSH-вызовов
+        (проверка соединения, проверка файла, запуск ansible-playbook):
+        - SSH_READY_MARKER в stdout подтверждает установленное соединение;
+        - при отсутствии playbook в stderr выводится PLAYBOOK_NOT_FOUND_MARKER.
+        """
+        prefix = (
+            f"echo {self.SSH_READY_MARKER}; "
+            f"test -f {shlex.quote(playbook_full_path)} || "
+            f"{{ echo {self.PLAYBOOK_NOT_FOUND_MARKER} >&2; exit 1; }};"
+        )
+        return [prefix] + ansible_cmd
+
+    def _is_playbook_missing(self, error_output: str) -> bool:
+        """Проверяет, завершилась ли команда из-за отсутствия playbook"""
+        return self.PLAYBOOK_NOT_FOUND_MARKER in error_output
+
     async def update_application(self,
                                server_name: str,
                                app_name: str,
@@ -497,7 +705,7 @@ class SSHAnsibleService:
             orchestrator_haproxy_api_url = extra_params.get('haproxy_api_url')
             orchestrator_haproxy_backend = extra_params.get('haproxy_backend')
             orchestrator_wait_after_update = extra_params.get('wait_after_update')
-            logger.info(f"Получены extra_params для orchestrator: {extra_params}")
+            logger.info("Получены extra_params для orchestrator: %s", extra_params)
 
         # Если путь к playbook не указан, используем playbook по умолчанию
         if not playbook_path:
@@ -514,18 +722,16 @@ class SSHAnsibleService:
             return False, error_msg, ""
         
         # Формируем полный путь к playbook
-        playbook_full_path = os.path.join(
-            self.ssh_config.ansible_path, 
-            playbook_config.path.lstrip('/')
-        )
+        playbook_full_path = self.build_playbook_full_path(playbook_config.path)
         
+        server_id = None
+
         try:
-            # Получаем ID сервера по имени
-            from app.models.server import Server
+            # Получаем ID сервера по имени (с кэшированием)
             from app.models.application_instance import ApplicationInstance
 
-            server = Server.query.filter_by(name=server_name).first()
-            if not server:
+            server_id = self._resolve_server_id(server_name)
+            if server_id is None:
                 error_msg = f"Сервер с именем {server_name} не найден"
                 logger.error(error_msg)
                 return False, error_msg, ""
@@ -540,47 +746,12 @@ class SSHAnsibleService:
                 if hasattr(app, 'docker_image'):
                     image_url = app.docker_image
             
-            # Проверяем SSH-соединение
-            connection_ok, connection_msg = await self.test_connection()
-            if not connection_ok:
-                await self._create_event(
-                    event_type='update',
-                    description=f"Ошибка SSH-подключения при обновлении {app_name} на {server_name}: {connection_msg}",
-                    status='failed',
-                    server_id=server.id,
-                    instance_id=app_id
-                )
-                return False, f"SSH-соединение не удалось: {connection_msg}", ""
-            
-            # Записываем событие о начале обновления
-            await self._create_event(
-                event_type='update',
-                description=f"Запуск обновления приложения {app_name} на сервере {server_name}",
-                status='pending',
-                server_id=server.id,
-                instance_id=app_id
-            )
-            
-            # Проверяем существование playbook на удаленном хосте
-            if not await self._remote_file_exists(playbook_full_path):
-                error_msg = f"Ansible playbook не найден на удаленном хосте: {playbook_full_path}"
-                logger.error(error_msg)
-
-                await self._create_event(
-                    event_type='update',
-                    description=f"Ошибка обновления {app_name} на {server_name}: {error_msg}",
-                    status='failed',
-                    server_id=server.id,
-                    instance_id=app_id
-                )
-                return False, error_msg, ""
-            
             # Формируем контекст переменных из параметров события
             context_vars = self.build_context_vars(
                 server_name=server_name,
                 app_name=app_name,
                 app_id=app_id,
-                server_id=server.id,
+                server_id=server_id,
                 distr_url=distr_url,
                 mode=mode,
                 image_url=image_url,
@@ -602,12 +773,54 @@ class SSHAnsibleService:
                 verbose=True
             )
             
-            logger.info(f"Запуск Ansible через SSH: {' '.join(ansible_cmd)}")
+            ansible_cmd = self._wrap_remote_command(playbook_full_path, ansible_cmd)
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Запуск Ansible через SSH: %s", ' '.join(ansible_cmd))
+
+            connected = False
 
-            # Выполняем команду
+            async def on_connected():
+                # Записываем событие о начале обновления, как только SSH-соединение установлено
+                nonlocal connected
+                connected = True
+                await self._create_event(
+                    event_type='update',
+                    description=f"Запуск обновления приложения {app_name} на сервере {server_name}",
+                    status='pending',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
+
+            # Выполняем команду (соединение, проверка playbook и запуск - один SSH-вызов)
             success, output, error_output = await self._execute_ansible_command(
-                ansible_cmd, server.id, app_id, app_name, server_name, 'update', task_id
+                ansible_cmd, server_id, app_id, app_name, server_name, 'update', task_id,
+                on_connected=on_connected
             )
+
+            if not connected:
+                await self._create_event(
+                    event_type='update',
+                    description=f"Ошибка SSH-подключения при обновлении {app_name} на {server_name}: {error_output}",
+                    status='failed',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
+                return False, f"SSH-соединение не удалось: {error_output}", ""
+
+            # Проверка существования playbook выполняется в той же SSH-сессии
+            if not success and self._is_playbook_missing(error_output):
+                error_msg = f"Ansible playbook не найден на удаленном хосте: {playbook_full_path}"
+                logger.error(error_msg)
+
+                await self._create_event(
+                    event_type='update',
+                    description=f"Ошибка обновления {app_name} на {server_name}: {error_msg}",
+                    status='failed',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
+                return False, error_msg, ""
             
             if success:
                 result_msg = f"Обновление приложения {app_name} на сервере {server_name} выполнено успешно"
@@ -617,7 +830,7 @@ class SSHAnsibleService:
                     event_type='update',
                     description=f"Обновление {app_name} на {server_name} завершено успешно",
                     status='success',
-                    server_id=server.id,
+                    server_id=server_id,
                     instance_id=app_id
                 )
 
@@ -630,7 +843,7 @@ class SSHAnsibleService:
                     event_type='update',
                     description=f"Ошибка обновления {app_name} на {server_name}: {error_output}",
                     status='failed',
-                    server_id=server.id,
+                    server_id=server_id,
                     instance_id=app_id
                 )
 
@@ -645,7 +858,7 @@ class SSHAnsibleService:
                     event_type='update',
                     description=f"Критическая ошибка обновления {app_name} на {server_name}: {str(e)}",
                     status='failed',
-                    server_id=server.id if 'server' in locals() else None,
+                    server_id=server_id,
                     instance_id=app_id
                 )
             except:
@@ -692,51 +905,16 @@ class SSHAnsibleService:
         else:
             playbook_full_path = playbook_path
 
-        try:
-            # Получаем сервер по имени
-            from app.models.server import Server
+        server_id = None
 
-            server = Server.query.filter_by(name=server_name).first()
-            if not server:
+        try:
+            # Получаем ID сервера по имени (с кэшированием)
+            server_id = self._resolve_server_id(server_name)
+            if server_id is None:
                 error_msg = f"Сервер с именем {server_name} не найден"
                 logger.error(error_msg)
                 return False, error_msg, ""
 
-            # Проверяем SSH-соединение
-            connection_ok, connection_msg = await self.test_connection()
-            if not connection_ok:
-                await self._create_event(
-                    event_type=action,
-                    description=f"Ошибка SSH-подключения при {action} {app_name} на {server_name}: {connection_msg}",
-                    status='failed',
-                    server_id=server.id,
-                    instance_id=app_id
-                )
-                return False, f"SSH-соединение не удалось: {connection_msg}", ""
-
-            # Записываем событие о начале операции
-            await self._create_event(
-                event_type=action,
-                description=f"Запуск {action} для приложения {app_name} на сервере {server_name}",
-                status='pending',
-                server_id=server.id,
-                instance_id=app_id
-            )
-
-            # Проверяем существование playbook на удаленном хосте
-            if not await self._remote_file_exists(playbook_full_path):
-                error_msg = f"Ansible playbook не найден на удаленном хосте: {playbook_full_path}"
-                logger.error(error_msg)
-
-                await self._create_event(
-                    event_type=action,
-                    description=f"Ошибка {action} {app_name} на {server_name}: {error_msg}",
-                    status='failed',
-                    server_id=server.id,
-                    instance_id=app_id
-                )
-                return False, error_msg, ""
-
             # Формируем extra_vars для playbook
             extra_vars = {
                 'server': server_name,
@@ -751,13 +929,55 @@ class SSHAnsibleService:
                 verbose=True
             )
 
-            logger.info(f"Запуск Ansible ({action}) через SSH: {' '.join(ansible_cmd)}")
+            ansible_cmd = self._wrap_remote_command(playbook_full_path, ansible_cmd)
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Запуск Ansible (%s) через SSH: %s", action, ' '.join(ansible_cmd))
+
+            connected = False
+
+            async def on_connected():
+                # Записываем событие о начале операции, как только SSH-соединение установлено
+                nonlocal connected
+                connected = True
+                await self._create_event(
+                    event_type=action,
+                    description=f"Запуск {action} для приложения {app_name} на сервере {server_name}",
+                    status='pending',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
 
-            # Выполняем команду
+            # Выполняем команду (соединение, проверка playbook и запуск - один SSH-вызов)
             success, output, error_output = await self._execute_ansible_command(
-                ansible_cmd, server.id, app_id, app_name, server_name, action, task_id
+                ansible_cmd, server_id, app_id, app_name, server_name, action, task_id,
+                on_connected=on_connected
             )
 
+            if not connected:
+                await self._create_event(
+                    event_type=action,
+                    description=f"Ошибка SSH-подключения при {action} {app_name} на {server_name}: {error_output}",
+                    status='failed',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
+                return False, f"SSH-соединение не удалось: {error_output}", ""
+
+            # Проверка существования playbook выполняется в той же SSH-сессии
+            if not success and self._is_playbook_missing(error_output):
+                error_msg = f"Ansible playbook не найден на удаленном хосте: {playbook_full_path}"
+                logger.error(error_msg)
+
+                await self._create_event(
+                    event_type=action,
+                    description=f"Ошибка {action} {app_name} на {server_name}: {error_msg}",
+                    status='failed',
+                    server_id=server_id,
+                    instance_id=app_id
+                )
+                return False, error_msg, ""
+
             if success:
                 result_msg = f"{action} для приложения {app_name} на сервере {server_name} выполнен успешно"
                 logger.info(result_msg)
@@ -766,7 +986,7 @@ class SSHAnsibleService:
                     event_type=action,
                     description=f"{action} {app_name} на {server_name} завершен успешно",
                     status='success',
-                    server_id=server.id,
+                    server_id=server_id,
                     instance_id=app_id
                 )
 
@@ -788,7 +1008,7 @@ class SSHAnsibleService:
                     event_type=action,
                     description=f"Ошибка {action} {app_name} на {server_name}: {error_output}",
                     status='failed',
-                    server_id=server.id,
+                    server_id=server_id,
                     instance_id=app_id
                 )
 
@@ -803,7 +1023,7 @@ class SSHAnsibleService:
                     event_type=action,
                     description=f"Критическая ошибка {action} {app_name} на {server_name}: {str(e)}",
                     status='failed',
-                    server_id=server.id if 'server' in locals() else None,
+                    server_id=server_id,
                     instance_id=app_id
                 )
             except:
@@ -817,7 +1037,7 @@ class SSHAnsibleService:
         try:
             logger.info(f"Проверка SSH-соединения с {self.ssh_config.host}")
             
-            cmd = self._build_ssh_command(['echo', 'SSH connection test'])
+            cmd = self.build_ssh_command(['echo', 'SSH connection test'])
             
             process = await asyncio.create_subprocess_exec(
                 *cmd,
@@ -837,49 +1057,87 @@ class SSHAnsibleService:
                 else:
                     error_msg = stderr.decode().strip()
                     logger.error(f"Ошибка SSH-соединения: {error_msg}")
+                    # Новые вызовы пойдут через новое мастер-соединение, текущие сеансы доработают
+                    await self.close_connection()
                     return False, f"Ошибка SSH-соединения: {error_msg}"
                     
             except asyncio.TimeoutError:
                 logger.error("Таймаут при проверке SSH-соединения")
+                process.kill()
+                await process.wait()
+                await self.close_connection()
                 return False, "Таймаут при проверке SSH-соединения"
                 
         except Exception as e:
             logger.error(f"Исключение при проверке SSH-соединения: {str(e)}")
             return False, f"Исключение: {str(e)}"
     
-    async def _remote_file_exists(self, remote_path: str) -> bool:
-        """Проверка существования файла на удаленном хосте"""
+    async def close_connection(self) -> bool:
+        """
+        Выводит мастер-соединение ControlMaster из использования (ssh -O stop).
+        Сокет ControlPath общий для всех потоков и воркеров, поэтому мастер не
+        завершается (-O exit оборвал бы мультиплексированные через него сеансы,
+        включая идущие ansible-playbook): он перестает принимать новые сеансы и
+        закрывается после завершения текущих, а следующий вызов ssh открывает новый
+        """
+        if not self.ssh_config.control_path:
+            return False
+
+        cmd = [
+            'ssh',
+            '-o', f'ControlPath={self.ssh_config.control_path}',
+            '-p', str(self.ssh_config.port),
+            '-O', 'stop',
+            f'{self.ssh_config.user}@{self.ssh_config.host}'
+        ]
+
         try:
-            cmd = self._build_ssh_command(['test', '-f', remote_path, '&&', 'echo', 'exists'])
-            
             process = await asyncio.create_subprocess_exec(
                 *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
             )
-            
-            stdout, _ = await process.communicate()
-            
-            return b'exists' in stdout
+            await asyncio.wait_for(process.wait(), timeout=self.ssh_config.connection_timeout)
+            return process.returncode == 0
         except Exception as e:
-            logger.error(f"Ошибка при проверке существования файла {remote_path}: {str(e)}")
+            logger.warning(f"Ошибка при остановке мастер-соединения SSH: {str(e)}")
             return False
-    
-    def _build_ssh_command(self, remote_command: list) -> list:
-        """Формирует SSH команду для выполнения"""
+
+    def _build_base_ssh_args(self) -> List[str]:
+        """Аргументы ssh до удаленной команды (опции и user@host)"""
         ssh_cmd = ['ssh']
         
         if self.ssh_config.key_file:
             ssh_cmd.extend(['-i', self.ssh_config.key_file])
+
+        # Мультиплексирование: первый вызов поднимает мастер-соединение,
+        # последующие переиспользуют его без нового TCP/SSH handshake
+        if self.ssh_config.control_path:
+            ssh_cmd.extend([
+                '-o', 'ControlMaster=auto',
+                '-o', f'ControlPath={self.ssh_config.control_path}',
+                '-o', f'ControlPersist={self.ssh_config.control_persist}',
+                # Keepalive: «мёртвое» мастер-соединение обнаруживается и закрывается само
+                '-o', 'ServerAliveInterval=15',
+                '-o', 'ServerAliveCountMax=3'
+            ])
         
         ssh_cmd.extend([
+            # Без интерактивных запросов пароля: ssh не зависает без терминала
+            '-o', 'BatchMode=yes',
             '-o', 'StrictHostKeyChecking=no',
             '-o', 'UserKnownHostsFile=/dev/null',
             '-o', f'ConnectTimeout={self.ssh_config.connection_timeout}',
             '-p', str(self.ssh_config.port),
             f'{self.ssh_config.user}@{self.ssh_config.host}'
         ])
-        
+
+        return ssh_cmd
+
+    def build_ssh_command(self, remote_command: list) -> list:
+        """Формирует SSH команду для выполнения"""
+        ssh_cmd = list(self._ssh_prefix)
+
         if isinstance(remote_command, list) and len(remote_command) == 3 and remote_command[1] == '-c':
             ssh_cmd.extend(remote_command)
         else:
@@ -887,58 +1145,65 @@ class SSHAnsibleService:
         
         return ssh_cmd
     
-    def _parse_ansible_output(self, line: str) -> Optional[Dict[str, Any]]:
-        """Парсит вывод Ansible для отслеживания этапов"""
-        line = line.strip()
-        
-        if "PLAY [" in line:
+    def _parse_ansible_output(self, line: bytes) -> Optional[Dict[str, Any]]:
+        """Парсит сырую строку вывода Ansible для отслеживания этапов (без пробелов по краям)"""
+        if not line or line[0] not in self.ANSIBLE_MARKER_FIRST_BYTES:
+            return None
+
+        match = self.ANSIBLE_LINE_PATTERN.match(line)
+        if not match:
+            return None
+
+        kind = match.lastgroup
+
+        if kind == 'play':
             self.current_stage = PlaybookStage.GATHERING_FACTS
-            return {"stage": "play_start", "message": line}
-            
-        elif "TASK [Gathering Facts]" in line:
+            return {"stage": "play_start", "message": line.decode('utf-8', errors='ignore')}
+
+        elif kind == 'gathering_facts':
             self.current_stage = PlaybookStage.GATHERING_FACTS
             return {"stage": "gathering_facts", "message": "Сбор информации о системе"}
-            
-        elif "TASK [" in line:
+
+        elif kind == 'task':
             self.current_stage = PlaybookStage.RUNNING_TASKS
-            task_name = line.split("TASK [")[1].split("]")[0]
+            task_name = match.group('task').decode('utf-8', errors='ignore')
             return {"stage": "task", "message": f"Выполнение задачи: {task_name}"}
-            
-        elif "RUNNING HANDLER [" in line:
+
+        elif kind == 'handler':
             self.current_stage = PlaybookStage.HANDLERS
-            handler_name = line.split("RUNNING HANDLER [")[1].split("]")[0]
+            handler_name = match.group('handler').decode('utf-8', errors='ignore')
             return {"stage": "handler", "message": f"Выполнение обработчика: {handler_name}"}
-            
-        elif "PLAY RECAP" in line:
+
+        elif kind == 'recap':
             self.current_stage = PlaybookStage.COMPLETED
             return {"stage": "recap", "message": "Завершение playbook"}
-            
-        elif "fatal:" in line or "ERROR!" in line:
+
+        elif kind == 'error':
             self.current_stage = PlaybookStage.FAILED
-            return {"stage": "error", "message": line}
-            
-        elif "ok:" in line:
-            return {"stage": "task_ok", "message": line}
-            
-        elif "changed:" in line:
-            return {"stage": "task_changed", "message": line}
-            
-        elif "skipping:" in line:
-            return {"stage": "task_skipped", "message": line}
-            
-        return None
+            return {"stage": "error", "message": line.decode('utf-8', errors='ignore')}
+
+        # ok / changed / skipping
+        return {"stage": self.ANSIBLE_RESULT_STAGES[kind], "message": line.decode('utf-8', errors='ignore')}
     
     async def _execute_ansible_command(self, ansible_cmd: list, server_id: int, app_id: int,
                                      app_name: str, server_name: str, action: str,
-                                     task_id: Optional[str] = None) -> Tuple[bool, str, str]:
-        """Выполняет команду Ansible через SSH с отслеживанием этапов"""
-        ssh_cmd = self._build_ssh_command(ansible_cmd)
+                                     task_id: Optional[str] = None,
+                                     on_connected: Optional[Callable[[], Awaitable[None]]] = None
+                                     ) -> Tuple[bool, str, str]:
+        """
+        Выполняет команду Ansible через SSH с отслеживанием этапов
+
+        Строка SSH_READY_MARKER в stdout (см. _wrap_remote_command) означает, что
+        SSH-соединение установлено: она не попадает в вывод, а вызывает on_connected.
+        """
+        ssh_cmd = self.build_ssh_command(ansible_cmd)
 
         try:
             process = await asyncio.create_subprocess_exec(
                 *ssh_cmd,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=self.STREAM_READ_LIMIT
             )
 
             # Регистрируем процесс для возможности отмены
@@ -946,76 +1211,108 @@ class SSHAnsibleService:
                 SSHAnsibleService._active_processes[task_id] = process
                 logger.info(f"Зарегистрирован процесс для задачи {task_id} (PID: {process.pid})")
                 # Сохраняем PID в Task для отображения в UI
-                try:
-                    from app.models.task import Task
-                    task = Task.query.get(task_id)
-                    if task:
-                        task.pid = process.pid
-                        db.session.commit()
-                        logger.info(f"PID {process.pid} сохранен для задачи {task_id}")
-                except Exception as e:
-                    logger.warning(f"Не удалось сохранить PID для задачи {task_id}: {e}")
-
-            stdout_lines = []
-            stderr_lines = []
+                await self._run_db_write(self._save_task_pid_sync, task_id, process.pid)
+
+            # stdout нужен целиком (сохраняется в task.result и разбирается
+            # для PLAY RECAP/summary), от stderr храним только хвост для сообщения об ошибке
+            # Полный stdout копится в одном bytearray (без объекта на каждую строку)
+            # и декодируется один раз в конце
+            stdout_buf = bytearray()
+            stderr_lines = deque(maxlen=self.OUTPUT_TAIL_LINES)
+
+            # Этапы и stderr пишутся в лог пачками, а не вызовом логгера на каждую строку
+            stage_log = _BatchedLog(logging.INFO, f"Ansible {action} для {app_name}")
+            stderr_log = _BatchedLog(logging.WARNING, "Ansible stderr")
+            # Результаты задач (ok/changed/skipping) в лог не пишутся построчно,
+            # а считаются и выводятся одной итоговой записью
+            result_counts = dict.fromkeys(self.ANSIBLE_RESULT_STAGES.values(), 0)
+
+            async def handle_stdout_line(line):
+                line = line.strip()
+                if not line:
+                    return
+                if line == self._SSH_READY_MARKER_BYTES:
+                    if on_connected:
+                        await on_connected()
+                    return
+                if stdout_buf:
+                    stdout_buf += b'\n'
+                stdout_buf += line
+                stage_info = self._parse_ansible_output(line)
+                if stage_info:
+                    stage = stage_info['stage']
+                    if stage in result_counts:
+                        result_counts[stage] += 1
+                    else:
+                        stage_log.add(stage_info['message'])
+                    SSHAnsibleService._update_task_progress(task_id, stage_info)
 
             async def read_stdout():
-                """Читает stdout чанками для обработки длинных строк без переносов"""
-                buffer = b''
-                chunk_size = 8192  # Размер чанка для чтения
+                """
+                Читает stdout построчно. Поиск перевода строки выполняет буфер StreamReader;
+                строки длиннее лимита потока дочитываются частями и склеиваются
+                """
+                pending = bytearray()
 
                 while True:
-                    chunk = await process.stdout.read(chunk_size)
-                    if not chunk:
-                        # Обрабатываем остаток буфера
-                        if buffer:
-                            line_str = buffer.decode('utf-8', errors='ignore').strip()
-                            if line_str:
-                                stdout_lines.append(line_str)
-                                stage_info = self._parse_ansible_output(line_str)
-                                if stage_info:
-                                    logger.info(f"Ansible {action} для {app_name}: {stage_info['message']}")
-                                    SSHAnsibleService._update_task_progress(task_id, stage_info)
+                    try:
+                        line = await process.stdout.readuntil(b'\n')
+                    except asyncio.IncompleteReadError as e:
+                        # Конец потока: обрабатываем остаток без перевода строки
+                        pending += e.partial
+                        if pending:
+                            await handle_stdout_line(pending)
                         break
+                    except asyncio.LimitOverrunError as e:
+                        # Части длинной строки дописываются в bytearray на месте,
+                        # без пересоздания bytes на каждой итерации
+                        pending += await process.stdout.read(e.consumed)
+                        continue
 
-                    buffer += chunk
-                    
-                    # Ищем переносы строк в буфере
-                    while b'\n' in buffer:
-                        line, buffer = buffer.split(b'\n', 1)
-                        line_str = line.decode('utf-8', errors='ignore').strip()
-                        if line_str:
-                            stdout_lines.append(line_str)
-                            stage_info = self._parse_ansible_output(line_str)
-                            if stage_info:
-                                logger.info(f"Ansible {action} для {app_name}: {stage_info['message']}")
-                                SSHAnsibleService._update_task_progress(task_id, stage_info)
+                    if pending:
+                        pending += line
+                        await handle_stdout_line(pending)
+                        pending.clear()
+                    else:
+                        await handle_stdout_line(line)
 
             async def read_stderr():
-                while True:
-                    line = await process.stderr.readline()
-                    if not line:
-                        break
-                    line_str = line.decode('utf-8', errors='ignore').strip()
-                    if line_str:
+                async for line in process.stderr:
+                    # Пустые строки отсекаются до декодирования
+                    line = line.strip()
+                    if line:
+                        line_str = line.decode('utf-8', errors='ignore')
                         stderr_lines.append(line_str)
-                        logger.warning(f"Ansible stderr: {line_str}")
-
-            await asyncio.gather(
-                read_stdout(),
-                read_stderr()
-            )
+                        stderr_log.add(line_str)
 
+            # Таймаут ограничивает всё выполнение, включая чтение вывода: процесс,
+            # который продолжает писать в stdout, не может работать бесконечно
             try:
-                await asyncio.wait_for(process.wait(), timeout=self.ssh_config.command_timeout)
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        read_stdout(),
+                        read_stderr(),
+                        process.wait()
+                    ),
+                    timeout=self.ssh_config.command_timeout
+                )
             except asyncio.TimeoutError:
                 process.kill()
                 await process.wait()
                 SSHAnsibleService._cleanup_task(task_id)
                 return False, "", "Таймаут выполнения команды Ansible"
+            finally:
+                stage_log.flush()
+                stderr_log.flush()
+
+            logger.info(
+                "Ansible %s для %s завершен (код %s): ok=%d, changed=%d, skipped=%d",
+                action, app_name, process.returncode,
+                result_counts['task_ok'], result_counts['task_changed'], result_counts['task_skipped']
+            )
 
             success = process.returncode == 0
-            stdout_output = '\n'.join(stdout_lines)
+            stdout_output = stdout_buf.decode('utf-8', errors='ignore')
             stderr_output = '\n'.join(stderr_lines)
 
             SSHAnsibleService._cleanup_task(task_id)
@@ -1031,7 +1328,72 @@ class SSHAnsibleService:
     
     async def _create_event(self, event_type: str, description: str, status: str,
                           server_id: Optional[int] = None, instance_id: Optional[int] = None):
-        """Создает событие в БД"""
+        """
+        Создает событие в БД.
+        Запись выполняется в отдельном потоке, чтобы синхронный commit
+        не блокировал event loop на время обращения к БД.
+        """
+        await self._run_db_write(
+            self._create_event_sync, event_type, description, status, server_id, instance_id
+        )
+
+    @classmethod
+    def _get_db_executor(cls) -> ThreadPoolExecutor:
+        """Возвращает пул для записи в БД, создавая его при первом обращении"""
+        with cls._db_executor_lock:
+            if cls._db_executor is None:
+                cls._db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ssh-ansible-db')
+                # При выходе дожидаемся уже поставленных в очередь записей событий
+                atexit.register(cls._db_executor.shutdown, wait=True)
+            return cls._db_executor
+
+    async def _run_db_write(self, func: Callable[..., None], *args):
+        """
+        Выполняет синхронную запись в БД в рабочем потоке с собственным контекстом
+        приложения.
+
+        Без контекста приложения (вызов вне задачи очереди или запроса) передать
+        контекст в рабочий поток нельзя, поэтому func выполняется синхронно в
+        потоке event loop и блокирует его на время обращения к БД.
+        """
+        if not has_app_context():
+            logger.warning(
+                f"Нет контекста приложения: {func.__name__} выполняется синхронно в event loop"
+            )
+            func(*args)
+            return
+
+        app = current_app._get_current_object()
+        await asyncio.get_running_loop().run_in_executor(
+            self._get_db_executor(), self._call_in_app_context, app, func, *args
+        )
+
+    @staticmethod
+    def _call_in_app_context(app, func: Callable[..., None], *args):
+        """Вызывает func в собственном контексте приложения (для рабочего потока)"""
+        with app.app_context():
+            func(*args)
+
+    def _save_task_pid_sync(self, task_id: str, pid: int):
+        """
+        Синхронное сохранение PID процесса в Task.
+        Коммитится в отдельной сессии рабочего потока: загруженные ранее экземпляры
+        Task в других сессиях не видят новый pid, пока строка не будет перечитана
+        """
+        try:
+            from app.models.task import Task
+            task = Task.query.get(task_id)
+            if task:
+                task.pid = pid
+                db.session.commit()
+                logger.info(f"PID {pid} сохранен для задачи {task_id}")
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить PID для задачи {task_id}: {e}")
+            db.session.rollback()
+
+    def _create_event_sync(self, event_type: str, description: str, status: str,
+                           server_id: Optional[int], instance_id: Optional[int]):
+        """Синхронная запись события в БД"""
         try:
             event = Event(
                 event_type=event_type,
@@ -1046,57 +1408,141 @@ class SSHAnsibleService:
             logger.error(f"Ошибка при создании события: {str(e)}")
             db.session.rollback()
     
-    async def get_all_playbooks(self) -> Dict[str, Dict[str, Any]]:
-        """Получает список всех playbook файлов из ansible каталога"""
+    async def get_all_playbooks(self, force_refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Получает список всех playbook файлов из ansible каталога.
+        Успешный листинг кэшируется на PLAYBOOKS_CACHE_TTL секунд: повторные запросы
+        страниц и проверки файлов не выполняют ls по SSH каждый раз.
+
+        Args:
+            force_refresh: Игнорировать кэш и перечитать каталог
+        """
+        cached = self._playbooks_cache.get(self._playbooks_cache_key())
+        if cached and not force_refresh and time.monotonic() - cached[0] < self.PLAYBOOKS_CACHE_TTL:
+            return {name: dict(info) for name, info in cached[1].items()}
+
         try:
             logger.info(f"Получение списка всех playbooks из {self.ssh_config.ansible_path}")
             
-            bash_cmd = f"cd {self.ssh_config.ansible_path} && ls -1 *.yml *.yaml 2>/dev/null || true"
-            
-            ssh_cmd = self._build_ssh_command(['bash', '-c', f'"{bash_cmd}"'])
+            ssh_cmd = self.build_ssh_command(self._playbook_listing_command())
             
             process = await asyncio.create_subprocess_exec(
                 *ssh_cmd,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=self.STREAM_READ_LIMIT
             )
             
+            async def read_lines():
+                # Строки листинга декодируются по мере поступления, без буфера всего вывода
+                return [line.decode('utf-8', errors='ignore') async for line in process.stdout]
+
             try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
+                lines, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(read_lines(), process.stderr.read(), process.wait()),
                     timeout=self.ssh_config.connection_timeout
                 )
-                
-                output = stdout.decode().strip()
-                
-                if not output:
-                    logger.warning(f"Не найдено playbook файлов в {self.ssh_config.ansible_path}")
-                    return {}
-                
-                file_list = output.split('\n')
-                file_list = [f.strip() for f in file_list if f.strip()]
-                
-                results = {}
-                for filename in file_list:
-                    if 'cannot access' in filename or filename.startswith('ls:'):
-                        continue
-                        
-                    results[filename] = {
-                        'exists': True,
-                        'path': os.path.join(self.ssh_config.ansible_path, filename)
-                    }
-                
-                logger.info(f"Найдено {len(results)} playbook файлов: {list(results.keys())}")
-                return results
-                
             except asyncio.TimeoutError:
                 logger.error("Таймаут при получении списка playbooks")
+                process.kill()
+                await process.wait()
+                return {}
+
+            if process.returncode != 0:
+                logger.error(f"Ошибка при получении списка playbooks: {stderr.decode().strip()}")
                 return {}
+
+            return self._store_playbook_listing(lines)
                 
         except Exception as e:
             logger.error(f"Исключение при получении списка playbooks: {str(e)}")
             return {}
 
+    async def check_connection_and_playbooks(self) -> Tuple[bool, str, Dict[str, Dict[str, Any]]]:
+        """
+        Проверка SSH-соединения и получение списка playbook-ов одним SSH-вызовом
+        (вместо test_connection и get_all_playbooks по отдельности)
+
+        Returns:
+            Tuple[bool, str, Dict]: (соединение установлено, сообщение, playbook-и как в get_all_playbooks)
+        """
+        try:
+            logger.info(f"Проверка SSH-соединения и списка playbooks на {self.ssh_config.host}")
+
+            ssh_cmd = self.build_ssh_command(
+                ['echo', self.SSH_READY_MARKER, ';'] + self._playbook_listing_command()
+            )
+
+            process = await asyncio.create_subprocess_exec(
+                *ssh_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=self.STREAM_READ_LIMIT
+            )
+
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(),
+                    timeout=self.ssh_config.connection_timeout
+                )
+            except asyncio.TimeoutError:
+                logger.error("Таймаут при проверке SSH-соединения")
+                process.kill()
+                await process.wait()
+                await self.close_connection()
+                return False, "Таймаут при проверке SSH-соединения", {}
+
+            lines = stdout.decode().split('\n')
+            if process.returncode != 0 or not lines or lines[0].strip() != self.SSH_READY_MARKER:
+                error_msg = stderr.decode().strip()
+                logger.error(f"Ошибка SSH-соединения: {error_msg}")
+                # Новые вызовы пойдут через новое мастер-соединение, текущие сеансы доработают
+                await self.close_connection()
+                return False, f"Ошибка SSH-соединения: {error_msg}", {}
+
+            logger.info("SSH-соединение успешно установлено")
+            return True, "SSH-соединение успешно установлено", self._store_playbook_listing(lines[1:])
+
+        except Exception as e:
+            logger.error(f"Исключение при проверке SSH-соединения: {str(e)}")
+            return False, f"Исключение: {str(e)}", {}
+
+    def _playbooks_cache_key(self) -> Tuple[str, int, str]:
+        return (self.ssh_config.host, self.ssh_config.port, self.ssh_config.ansible_path)
+
+    def _playbook_listing_command(self) -> List[str]:
+        """
+        Удаленная команда листинга ansible каталога: ls без вложенного bash и
+        glob-шаблонов, расширения .yml/.yaml отбираются в _store_playbook_listing
+        """
+        return ['ls', '-1', '--', shlex.quote(self.ssh_config.ansible_path), '2>/dev/null', '||', 'true']
+
+    def _store_playbook_listing(self, lines: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Разбирает вывод ls -1 ansible каталога и сохраняет результат в кэш листинга"""
+        results = {}
+        # Путь на удаленном Unix-хосте: префикс каталога собирается один раз
+        base_path = self.ssh_config.ansible_path.rstrip('/') + '/'
+        for filename in lines:
+            filename = filename.strip()
+            if not filename.endswith(self.PLAYBOOK_EXTENSIONS):
+                continue
+
+            results[filename] = {
+                'exists': True,
+                'path': base_path + filename
+            }
+
+        SSHAnsibleService._playbooks_cache[self._playbooks_cache_key()] = (
+            time.monotonic(),
+            {name: dict(info) for name, info in results.items()}
+        )
+
+        if results:
+            logger.info("Найдено %d playbook файлов: %s", len(results), list(results))
+        else:
+            logger.warning(f"Не найдено playbook файлов в {self.ssh_config.ansible_path}")
+        return results
+
 # Синглтон для получения экземпляра сервиса
 _ssh_ansible_service = None
 
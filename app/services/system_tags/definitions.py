@@ -10,7 +10,8 @@
 
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional, Callable, Any
+from types import MappingProxyType
+from typing import Optional, Callable, Any, Mapping
 
 
 class TriggerType(Enum):
@@ -191,24 +192,48 @@ def get_tag_definition(tag_name: str) -> Optional[SystemTagDefinition]:
     return SYSTEM_TAGS.get(tag_name)
 
 
+def _build_lookup_tables():
+    """
+    Производные таблицы поиска по реестру. Реестр заполняется один раз
+    при импорте, поэтому таблицы строятся сразу после него, а не на каждый вызов
+    """
+    global _TAGS_BY_TRIGGER, _MAPPING_TAGS, _APP_TYPE_TAGS
+
+    tags_by_trigger: dict[TriggerType, list[SystemTagDefinition]] = {}
+    for tag in SYSTEM_TAGS.values():
+        tags_by_trigger.setdefault(tag.trigger_type, []).append(tag)
+    _TAGS_BY_TRIGGER = {trigger: tuple(tags) for trigger, tags in tags_by_trigger.items()}
+
+    _MAPPING_TAGS = MappingProxyType({
+        tag.mapping_entity_type: tag
+        for tag in _TAGS_BY_TRIGGER.get(TriggerType.MAPPING, ())
+        if tag.mapping_entity_type
+    })
+
+    _APP_TYPE_TAGS = MappingProxyType({
+        tag.app_type_value: tag
+        for tag in _TAGS_BY_TRIGGER.get(TriggerType.APP_TYPE, ())
+        if tag.app_type_value
+    })
+
+
+_TAGS_BY_TRIGGER: dict[TriggerType, tuple[SystemTagDefinition, ...]] = {}
+_MAPPING_TAGS: Mapping[str, SystemTagDefinition] = MappingProxyType({})
+_APP_TYPE_TAGS: Mapping[str, SystemTagDefinition] = MappingProxyType({})
+
+_build_lookup_tables()
+
+
 def get_tags_by_trigger_type(trigger_type: TriggerType) -> list[SystemTagDefinition]:
     """Получить теги по типу триггера"""
-    return [tag for tag in SYSTEM_TAGS.values() if tag.trigger_type == trigger_type]
+    return list(_TAGS_BY_TRIGGER.get(trigger_type, ()))
 
 
-def get_mapping_tags() -> dict[str, SystemTagDefinition]:
-    """Получить теги с автоназначением по маппингу"""
-    return {
-        tag.mapping_entity_type: tag
-        for tag in SYSTEM_TAGS.values()
-        if tag.trigger_type == TriggerType.MAPPING and tag.mapping_entity_type
-    }
+def get_mapping_tags() -> Mapping[str, SystemTagDefinition]:
+    """Получить теги с автоназначением по маппингу (только для чтения)"""
+    return _MAPPING_TAGS
 
 
-def get_app_type_tags() -> dict[str, SystemTagDefinition]:
-    """Получить теги с автоназначением по app_type"""
-    return {
-        tag.app_type_value: tag
-        for tag in SYSTEM_TAGS.values()
-        if tag.trigger_type == TriggerType.APP_TYPE and tag.app_type_value
-    }
+def get_app_type_tags() -> Mapping[str, SystemTagDefinition]:
+    """Получить теги с автоназначением по app_type (только для чтения)"""
+    return _APP_TYPE_TAGS
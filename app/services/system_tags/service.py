@@ -12,6 +12,9 @@
 import logging
 from typing import TYPE_CHECKING, Optional
 
+from sqlalchemy import delete, event, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
 from app import db
 from app.config import Config
 from app.models.tag import Tag, ApplicationInstanceTag
@@ -33,6 +36,21 @@ logger = logging.getLogger(__name__)
 class SystemTagsService:
     """Сервис для управления системными тегами"""
 
+    # Кэш ID системных тегов (tag_name -> tag_id). Системные теги нельзя удалить
+    # или переименовать через API, поэтому закоммиченные ID не меняются за время работы.
+    # Сбрасывается при создании тега и при откате сессии, чтобы не хранить ID
+    # незакоммиченного тега
+    _tag_id_cache: dict[str, int] = {}
+
+    # Теги, автоназначение которых включено в конфиге. Config не меняется во время
+    # работы, поэтому флаги config_key читаются один раз при импорте
+    _AUTO_ASSIGN_ENABLED_TAGS = frozenset(
+        tag_def.name
+        for tag_def in SYSTEM_TAGS.values()
+        if tag_def.trigger_type != TriggerType.MANUAL
+        and (not tag_def.config_key or getattr(Config, tag_def.config_key, False))
+    )
+
     @classmethod
     def is_enabled(cls) -> bool:
         """Проверить, включена ли система тегов глобально"""
@@ -41,32 +59,43 @@ class SystemTagsService:
     @classmethod
     def is_tag_enabled(cls, tag_def: SystemTagDefinition) -> bool:
         """Проверить, включен ли конкретный тег для автоназначения"""
-        if not cls.is_enabled():
-            return False
-        if tag_def.trigger_type == TriggerType.MANUAL:
-            return False  # Ручные теги не автоназначаются
-        if not tag_def.config_key:
-            return True  # Если нет ключа конфига - всегда включен
-        return getattr(Config, tag_def.config_key, False)
+        # Ручные теги не автоназначаются, теги без ключа конфига всегда включены
+        return cls.is_enabled() and tag_def.name in cls._AUTO_ASSIGN_ENABLED_TAGS
 
     @classmethod
     def is_auto_assign_disabled(cls, instance: 'ApplicationInstance', tag_name: str) -> bool:
         """Проверить, отключено ли автоназначение для конкретного instance+tag"""
-        tag = Tag.query.filter_by(name=tag_name).first()
-        if not tag:
+        tag_id = cls._get_tag_id(tag_name)
+        if tag_id is None:
             return False
         link = ApplicationInstanceTag.query.filter_by(
             application_id=instance.id,
-            tag_id=tag.id
+            tag_id=tag_id
         ).first()
         return link.auto_assign_disabled if link else False
 
     @classmethod
-    def _get_or_create_tag(cls, tag_name: str) -> Optional[Tag]:
-        """Получить тег из БД или создать если не существует"""
-        tag = Tag.query.filter_by(name=tag_name).first()
-        if tag:
-            return tag
+    def _get_tag_id(cls, tag_name: str) -> Optional[int]:
+        """Получить ID тега по имени (для системных тегов - из кэша)"""
+        tag_id = cls._tag_id_cache.get(tag_name)
+        if tag_id is not None:
+            return tag_id
+
+        if tag_name in SYSTEM_TAGS:
+            # Первый промах загружает ID всех системных тегов одним запросом
+            rows = db.session.query(Tag.id, Tag.name).filter_by(is_system=True).all()
+            cls._tag_id_cache.update({name: tag_id for tag_id, name in rows if name in SYSTEM_TAGS})
+            return cls._tag_id_cache.get(tag_name)
+
+        row = db.session.query(Tag.id).filter_by(name=tag_name).first()
+        return row[0] if row else None
+
+    @classmethod
+    def _get_or_create_tag_id(cls, tag_name: str) -> Optional[int]:
+        """Получить ID тега из БД или создать тег если не существует"""
+        tag_id = cls._get_tag_id(tag_name)
+        if tag_id is not None:
+            return tag_id
 
         # Создаем тег если его нет (на случай если миграция не была применена)
         tag_def = get_tag_definition(tag_name)
@@ -87,8 +116,30 @@ class SystemTagsService:
             css_class='tag-system'
         )
         db.session.add(tag)
+        db.session.flush()
+        # ID станет постоянным только после коммита - до него кэш не должен его содержать
+        cls._tag_id_cache.clear()
         logger.info(f"Создан системный тег '{tag_name}'")
-        return tag
+        return tag.id
+
+    @classmethod
+    def _refresh_tags_cache(cls, application_ids: list[int]) -> None:
+        """
+        Пересчитать tags_cache приложений одним UPDATE. Нужен для связей,
+        записанных в обход unit of work (bulk insert, Core-выражения), - их
+        не видит слушатель after_flush, который обновляет tags_cache
+        """
+        if not application_ids:
+            return
+        db.session.execute(text("""
+            UPDATE application_instances ai SET tags_cache = COALESCE((
+                SELECT string_agg(t.name, ',' ORDER BY t.name)
+                FROM tags t
+                JOIN application_instance_tags ait ON t.id = ait.tag_id
+                WHERE ait.application_id = ai.id
+            ), '')
+            WHERE ai.id = ANY(:app_ids)
+        """), {'app_ids': list(application_ids)})
 
     @classmethod
     def assign_tag(cls, instance: 'ApplicationInstance', tag_name: str,
@@ -102,30 +153,31 @@ class SystemTagsService:
             assigned_by: Кто назначил (system, manual, ...)
 
         Returns:
-            True если тег был назначен, False если уже был или ошибка
+            True если тег был назначен, False если уже был (или автоназначение
+            отключено) или ошибка
         """
         try:
-            tag = cls._get_or_create_tag(tag_name)
-            if not tag:
+            tag_id = cls._get_or_create_tag_id(tag_name)
+            if tag_id is None:
                 return False
 
-            # Проверяем, не назначен ли уже
-            existing = ApplicationInstanceTag.query.filter_by(
-                application_id=instance.id,
-                tag_id=tag.id
-            ).first()
-
-            if existing:
+            # Проверка и вставка одним выражением: существующая связь (в том числе
+            # с отключенным автоназначением) не меняется
+            stmt = (
+                pg_insert(ApplicationInstanceTag)
+                .values(
+                    application_id=instance.id,
+                    tag_id=tag_id,
+                    assigned_by=assigned_by,
+                    auto_assign_disabled=False
+                )
+                .on_conflict_do_nothing(index_elements=['application_id', 'tag_id'])
+                .returning(ApplicationInstanceTag.id)
+            )
+            if db.session.execute(stmt).scalar() is None:
                 return False  # Тег уже назначен
 
-            # Создаем связь
-            link = ApplicationInstanceTag(
-                application_id=instance.id,
-                tag_id=tag.id,
-                assigned_by=assigned_by,
-                auto_assign_disabled=False
-            )
-            db.session.add(link)
+            cls._refresh_tags_cache([instance.id])
             logger.debug(f"Тег '{tag_name}' назначен приложению {instance.name} (id={instance.id})")
             return True
 
@@ -146,24 +198,22 @@ class SystemTagsService:
             True если тег был удален, False если не был назначен или ошибка
         """
         try:
-            tag = Tag.query.filter_by(name=tag_name).first()
-            if not tag:
+            tag_id = cls._get_tag_id(tag_name)
+            if tag_id is None:
                 return False
 
-            link = ApplicationInstanceTag.query.filter_by(
-                application_id=instance.id,
-                tag_id=tag.id
-            ).first()
-
-            if not link:
-                return False  # Тег не был назначен
-
-            # Проверяем, не отключено ли автоудаление
-            if link.auto_assign_disabled:
-                logger.debug(f"Автоудаление тега '{tag_name}' отключено для {instance.name}")
-                return False
+            # Связь с отключенным автоудалением (auto_assign_disabled) не удаляется
+            result = db.session.execute(
+                delete(ApplicationInstanceTag).where(
+                    ApplicationInstanceTag.application_id == instance.id,
+                    ApplicationInstanceTag.tag_id == tag_id,
+                    ApplicationInstanceTag.auto_assign_disabled.is_(False)
+                )
+            )
+            if not result.rowcount:
+                return False  # Тег не был назначен или автоудаление отключено
 
-            db.session.delete(link)
+            cls._refresh_tags_cache([instance.id])
             logger.debug(f"Тег '{tag_name}' удален с приложения {instance.name} (id={instance.id})")
             return True
 
@@ -198,10 +248,7 @@ class SystemTagsService:
             logger.debug(f"Автоназначение тега '{tag_def.name}' отключено в конфиге")
             return False
 
-        if cls.is_auto_assign_disabled(instance, tag_def.name):
-            logger.debug(f"Автоназначение тега '{tag_def.name}' отключено для {instance.name}")
-            return False
-
+        # Связь с отключенным автоназначением уже существует, и assign_tag ее не меняет
         return cls.assign_tag(instance, tag_def.name, assigned_by='auto:mapping')
 
     @classmethod
@@ -246,28 +293,42 @@ class SystemTagsService:
         assigned = []
         app_type_tags = get_app_type_tags()
 
-        # Предзагружаем текущие теги instance для избежания N+1 запросов
-        instance_tag_names = set()
-        try:
-            instance_tag_names = {t.name for t in instance.tags}
-        except Exception:
-            pass  # Если теги недоступны, продолжаем без оптимизации
+        # Все связи instance с тегами одним запросом: дальше решения о назначении
+        # и удалении принимаются по этому словарю без запросов на каждый тег
+        links = {
+            tag_name: link
+            for link, tag_name in db.session.query(ApplicationInstanceTag, Tag.name)
+            .join(Tag, Tag.id == ApplicationInstanceTag.tag_id)
+            .filter(ApplicationInstanceTag.application_id == instance.id)
+        }
 
         # Назначаем тег если app_type совпадает
+        # (существующая связь - либо тег уже назначен, либо автоназначение отключено)
         tag_def = app_type_tags.get(instance.app_type)
-        if tag_def and cls.is_tag_enabled(tag_def):
-            if not cls.is_auto_assign_disabled(instance, tag_def.name):
-                if cls.assign_tag(instance, tag_def.name, assigned_by='auto:app_type'):
-                    assigned.append(tag_def.name)
+        if tag_def and tag_def.name not in links and cls.is_tag_enabled(tag_def):
+            tag_id = cls._get_or_create_tag_id(tag_def.name)
+            if tag_id is not None:
+                db.session.add(ApplicationInstanceTag(
+                    application_id=instance.id,
+                    tag_id=tag_id,
+                    assigned_by='auto:app_type',
+                    auto_assign_disabled=False
+                ))
+                assigned.append(tag_def.name)
+                logger.debug(f"Тег '{tag_def.name}' назначен приложению {instance.name} (id={instance.id})")
 
         # Удаляем теги app_type которые больше не соответствуют
-        # (только если тег фактически назначен - избегаем лишних запросов)
         for app_type_value, other_tag_def in app_type_tags.items():
-            if app_type_value != instance.app_type:
-                # Проверяем наличие тега перед удалением
-                if other_tag_def.name in instance_tag_names:
-                    if cls.is_tag_enabled(other_tag_def):
-                        cls.remove_tag(instance, other_tag_def.name)
+            if app_type_value == instance.app_type:
+                continue
+            link = links.get(other_tag_def.name)
+            if not link or not cls.is_tag_enabled(other_tag_def):
+                continue
+            if link.auto_assign_disabled:
+                logger.debug(f"Автоудаление тега '{other_tag_def.name}' отключено для {instance.name}")
+                continue
+            db.session.delete(link)
+            logger.debug(f"Тег '{other_tag_def.name}' удален с приложения {instance.name} (id={instance.id})")
 
         return assigned
 
@@ -280,7 +341,7 @@ class SystemTagsService:
         на основе текущих маппингов и app_type.
 
         Args:
-            batch_size: Размер батча для коммитов (по умолчанию 100)
+            batch_size: Размер пачки bulk insert и коммита (по умолчанию 100)
 
         Returns:
             Статистика миграции
@@ -302,75 +363,76 @@ class SystemTagsService:
             logger.warning("Система тегов отключена, миграция пропущена")
             return stats
 
-        operations_in_batch = 0
-
-        def commit_batch():
-            nonlocal operations_in_batch
-            if operations_in_batch > 0:
-                try:
+        def assign_in_bulk(tag_def: SystemTagDefinition, application_ids) -> None:
+            """
+            Назначить тег приложениям пачками: один запрос на уже назначенные
+            связи и bulk insert недостающих вместо assign_tag на каждое приложение
+            """
+            try:
+                tag_id = cls._get_or_create_tag_id(tag_def.name)
+                if tag_id is None:
+                    return
+
+                existing = {
+                    app_id for (app_id,) in
+                    db.session.query(ApplicationInstanceTag.application_id).filter_by(tag_id=tag_id)
+                }
+                rows = [
+                    {
+                        'application_id': app_id,
+                        'tag_id': tag_id,
+                        'assigned_by': 'migration',
+                        'auto_assign_disabled': False
+                    }
+                    for app_id in application_ids
+                    if app_id not in existing
+                ]
+
+                for offset in range(0, len(rows), batch_size):
+                    batch = rows[offset:offset + batch_size]
+                    db.session.bulk_insert_mappings(ApplicationInstanceTag, batch)
+                    cls._refresh_tags_cache([row['application_id'] for row in batch])
                     db.session.commit()
                     stats['batches_committed'] += 1
-                    operations_in_batch = 0
-                except Exception as e:
-                    db.session.rollback()
-                    stats['errors'] += 1
-                    logger.error(f"Ошибка коммита батча: {e}")
-                    operations_in_batch = 0
+                    stats[f'{tag_def.name}_assigned'] = stats.get(f'{tag_def.name}_assigned', 0) + len(batch)
+            except Exception as e:
+                db.session.rollback()
+                stats['errors'] += 1
+                logger.error(f"Ошибка назначения тега {tag_def.name} при миграции: {e}")
 
         try:
-            # 1. Теги на основе маппингов
-            mapping_tags = get_mapping_tags()
-
-            for entity_type, tag_def in mapping_tags.items():
+            # 1. Теги на основе маппингов: приложения с активным маппингом этого типа
+            for entity_type, tag_def in get_mapping_tags().items():
                 if not cls.is_tag_enabled(tag_def):
                     continue
 
-                # Находим все активные маппинги этого типа
-                mappings = ApplicationMapping.query.filter_by(
-                    entity_type=entity_type,
-                    is_active=True
-                ).all()
-
-                for mapping in mappings:
-                    try:
-                        instance = ApplicationInstance.query.get(mapping.application_id)
-                        if instance and not instance.deleted_at:
-                            if cls.assign_tag(instance, tag_def.name, assigned_by='migration'):
-                                stats[f'{tag_def.name}_assigned'] = stats.get(f'{tag_def.name}_assigned', 0) + 1
-                                operations_in_batch += 1
-
-                                if operations_in_batch >= batch_size:
-                                    commit_batch()
-                    except Exception as e:
-                        stats['errors'] += 1
-                        logger.warning(f"Ошибка назначения тега {tag_def.name} для mapping {mapping.id}: {e}")
+                application_ids = [
+                    app_id for (app_id,) in
+                    db.session.query(ApplicationMapping.application_id)
+                    .join(ApplicationInstance, ApplicationInstance.id == ApplicationMapping.application_id)
+                    .filter(
+                        ApplicationMapping.entity_type == entity_type,
+                        ApplicationMapping.is_active.is_(True),
+                        ApplicationInstance.deleted_at.is_(None)
+                    )
+                    .distinct()
+                ]
+                assign_in_bulk(tag_def, application_ids)
 
             # 2. Теги на основе app_type
-            app_type_tags = get_app_type_tags()
-
-            for app_type_value, tag_def in app_type_tags.items():
+            for app_type_value, tag_def in get_app_type_tags().items():
                 if not cls.is_tag_enabled(tag_def):
                     continue
 
-                instances = ApplicationInstance.query.filter_by(
-                    app_type=app_type_value,
-                    deleted_at=None
-                ).all()
-
-                for instance in instances:
-                    try:
-                        if cls.assign_tag(instance, tag_def.name, assigned_by='migration'):
-                            stats[f'{tag_def.name}_assigned'] = stats.get(f'{tag_def.name}_assigned', 0) + 1
-                            operations_in_batch += 1
-
-                            if operations_in_batch >= batch_size:
-                                commit_batch()
-                    except Exception as e:
-                        stats['errors'] += 1
-                        logger.warning(f"Ошибка назначения тега {tag_def.name} для instance {instance.id}: {e}")
-
-            # Финальный коммит оставшихся операций
-            commit_batch()
+                application_ids = [
+                    app_id for (app_id,) in
+                    db.session.query(ApplicationInstance.id).filter_by(
+                        app_type=app_type_value,
+                        deleted_at=None
+                    )
+                ]
+                assign_in_bulk(tag_def, application_ids)
+
             logger.info(f"Миграция системных тегов завершена: {stats}")
 
         except Exception as e:
@@ -398,13 +460,13 @@ class SystemTagsService:
         from app.models.tag import TagHistory
 
         try:
-            tag = Tag.query.filter_by(name=tag_name).first()
-            if not tag:
+            tag_id = cls._get_tag_id(tag_name)
+            if tag_id is None:
                 return False
 
             link = ApplicationInstanceTag.query.filter_by(
                 application_id=instance.id,
-                tag_id=tag.id
+                tag_id=tag_id
             ).first()
 
             if link:
@@ -413,7 +475,7 @@ class SystemTagsService:
                 # Создаем связь с флагом disabled
                 link = ApplicationInstanceTag(
                     application_id=instance.id,
-                    tag_id=tag.id,
+                    tag_id=tag_id,
                     assigned_by='manual',
                     auto_assign_disabled=disabled
                 )
@@ -423,7 +485,7 @@ class SystemTagsService:
             history = TagHistory(
                 entity_type='instance',
                 entity_id=instance.id,
-                tag_id=tag.id,
+                tag_id=tag_id,
                 action='auto_assign_disabled' if disabled else 'auto_assign_enabled',
                 changed_by=user,
                 details={'auto_assign_disabled': disabled}
@@ -436,3 +498,9 @@ class SystemTagsService:
         except Exception as e:
             logger.error(f"Ошибка установки auto_assign_disabled: {e}")
             return False
+
+
+@event.listens_for(db.session, 'after_rollback')
+def clear_tag_id_cache_after_rollback(session):
+    """Сбросить кэш ID системных тегов после отката: в нем мог оказаться ID тега, созданного в откаченной транзакции"""
+    SystemTagsService._tag_id_cache.clear()
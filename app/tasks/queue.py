@@ -13,6 +13,9 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Параметры в фигурных скобках: {param} или {param=value}
+_PARAM_RE = re.compile(r'\{([^}]+)\}')
+
 
 def parse_custom_params_from_playbook_path(playbook_path_with_params: str) -> dict:
     """
@@ -32,9 +35,8 @@ def parse_custom_params_from_playbook_path(playbook_path_with_params: str) -> di
         return {}
 
     custom_params = {}
-    param_pattern = r'\{([^}]+)\}'
 
-    for match in re.findall(param_pattern, playbook_path_with_params):
+    for match in _PARAM_RE.findall(playbook_path_with_params):
         if '=' in match:
             parts = match.split('=', 1)
             param_name = parts[0].strip()
@@ -383,7 +385,9 @@ class TaskQueue:
                         from app import db
                         from app.models.task import Task
 
-                        task = Task.query.get(task_id)
+                        # pid записывается SSHAnsibleService в отдельной сессии рабочего потока -
+                        # перечитываем строку, а не берем экземпляр из identity map, чтобы видеть актуальный pid
+                        task = Task.query.populate_existing().get(task_id)
                         if task:
                             task.status = "completed"
                             task.completed_at = datetime.utcnow()
@@ -398,7 +402,8 @@ class TaskQueue:
                         from app import db
                         from app.models.task import Task
 
-                        task = Task.query.get(task_id)
+                        # Перечитываем строку: pid мог быть записан в другой сессии
+                        task = Task.query.populate_existing().get(task_id)
                         if task:
                             task.status = "failed"
                             task.completed_at = datetime.utcnow()
@@ -805,8 +810,8 @@ class TaskQueue:
 
         # Получаем данные внутри контекста приложения
         with self.app.app_context():
+            from sqlalchemy.orm import joinedload
             from app.models.application_instance import ApplicationInstance
-            from app.models.server import Server
             from app.models.task import Task
             from app.services.ssh_ansible_service import SSHAnsibleService
             from app import db
@@ -820,8 +825,10 @@ class TaskQueue:
             is_batch_task = app_ids is not None and isinstance(app_ids, list) and len(app_ids) >= 1
 
             if is_batch_task:
-                # Групповая задача - загружаем все приложения по ID
-                apps = ApplicationInstance.query.filter(ApplicationInstance.id.in_(app_ids)).all()
+                # Групповая задача - загружаем все приложения по ID вместе с серверами (один JOIN)
+                apps = ApplicationInstance.query.options(
+                    joinedload(ApplicationInstance.server)
+                ).filter(ApplicationInstance.id.in_(app_ids)).all()
 
                 if not apps:
                     raise ValueError(f"Приложения с ID {app_ids} не найдены")
@@ -836,7 +843,7 @@ class TaskQueue:
 
                 # Берем данные из первого приложения
                 first_app = apps[0]
-                server = Server.query.get(first_app.server_id)
+                server = first_app.server
                 if not server:
                     raise ValueError(f"Сервер для приложения {first_app.instance_name} не найден")
 
@@ -846,12 +853,14 @@ class TaskQueue:
                 app_id = first_app.id  # Для логирования используем первый ID
 
             else:
-                # Одиночная задача - используем instance_id
-                app = ApplicationInstance.query.get(task.instance_id)
+                # Одиночная задача - используем instance_id, сервер загружается тем же запросом
+                app = ApplicationInstance.query.options(
+                    joinedload(ApplicationInstance.server)
+                ).get(task.instance_id)
                 if not app:
                     raise ValueError(f"Приложение с id {task.instance_id} не найдено")
 
-                server = Server.query.get(app.server_id)
+                server = app.server
                 if not server:
                     raise ValueError(f"Сервер для приложения {app.instance_name} не найден")
 